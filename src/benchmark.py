@@ -0,0 +1,284 @@
+"""
+benchmark.py - Measure how a WatcherManager tick performs against a local stand-in server
+Usage: python benchmark.py --watchers 200 --page-size 100000 --change-rate 0.1 --ticks 5 --output results.json
+"""
+import json
+import time
+import random
+import string
+import logging
+import argparse
+import resource
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from watcher.watcher import Watcher
+from watcher.watcher_manager import WatcherManager
+from watcher.body_scanner import BodyScanner
+from watcher.pattern_matcher import PatternMatcher
+
+# Keep the per-watcher logs quiet, but show the benchmark's own progress
+logging.basicConfig(
+    level=logging.WARNING,
+    format='[WebsiteWatcher][%(levelname)s][%(filename)s:%(funcName)s]: %(message)s')
+logger = logging.getLogger('benchmark')
+logger.setLevel(logging.INFO)
+
+def make_words(count: int, seed: int):
+    """Create random lowercase words
+
+    Args:
+        count (int): How many words to create
+        seed (int): The random seed, so runs are comparable
+
+    Returns:
+        list: The words
+    """
+    generator = random.Random(seed)
+    return [''.join(generator.choices(string.ascii_lowercase, k=generator.randint(5, 12))) for _ in range(count)]
+
+
+def serve_pages(port_queue, page_size: int, change_rate: float, use_etag: bool, delay: float, keywords: list):
+    """Serve synthetic pages until the process is terminated
+
+    Every request to /page/<n> has a change_rate chance of getting a new version of the page.
+
+    Args:
+        port_queue (multiprocessing.Queue): Where to report the port the server listens on
+        page_size (int): The size of every page, in bytes
+        change_rate (float): The chance of a page changing between two requests
+        use_etag (bool): Send ETags and answer 304 Not Modified when possible
+        delay (float): Seconds to wait before answering, to simulate a slow server
+        keywords (list): Words sprinkled into the pages, some of which the watchers look for
+    """
+    generator = random.Random(0)
+    filler = ' '.join(make_words(page_size // 8 + 1, seed=1))
+    base = f'<html><body><p>{" ".join(keywords[::2])}</p><div>{filler}</div>'
+    base = base[:max(page_size - 64, 0)]
+    versions = dict()
+    lock = threading.Lock()
+
+    class PageHandler(BaseHTTPRequestHandler):
+        """ Serve a page, changing it every now and then """
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if delay > 0:
+                time.sleep(delay)
+            with lock:
+                version = versions.get(self.path, 0)
+                if generator.random() < change_rate:
+                    version += 1
+                versions[self.path] = version
+            etag = f'"{version}"'
+            if use_etag and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            extra = keywords[version % len(keywords)] if keywords else ''
+            body = f'{base}<p>version {version} {extra}</p></body></html>'.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if use_etag:
+                self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class Profiler:
+    """ Time the fetches and the CPU spent hashing and matching, by wrapping the relevant methods """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fetch_latencies = []
+        self.scan_cpu = 0.0
+        self.match_cpu = 0.0
+        self.originals = []
+
+
+    def wrap(self, owner, name: str, record):
+        """Replace owner.name with a version that reports its duration to record
+
+        Args:
+            owner (type): The class holding the method
+            name (str): The method name
+            record (callable): Called with (wall_time, cpu_time) after every call
+        """
+        original = getattr(owner, name)
+        self.originals.append((owner, name, original))
+
+        def timed(*args, **kwargs):
+            wall_start = time.perf_counter()
+            cpu_start = time.thread_time()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                record(time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+        setattr(owner, name, timed)
+
+
+    def install(self):
+        """ Start profiling """
+        def record_fetch(wall_time, _):
+            with self.lock:
+                self.fetch_latencies.append(wall_time)
+
+        def record_scan(_, cpu_time):
+            with self.lock:
+                self.scan_cpu += cpu_time
+
+        def record_match(_, cpu_time):
+            with self.lock:
+                self.match_cpu += cpu_time
+
+        self.wrap(Watcher, 'read_page', record_fetch)
+        # BodyScanner.feed decodes, hashes and matches, PatternMatcher.first_hits is the matching part of it
+        self.wrap(BodyScanner, 'feed', record_scan)
+        self.wrap(PatternMatcher, 'first_hits', record_match)
+
+
+    def uninstall(self):
+        """ Stop profiling """
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+
+def percentile(values: list, fraction: float):
+    """Get a percentile of a list of values
+
+    Args:
+        values (list): The values
+        fraction (float): The percentile, between 0 and 1
+
+    Returns:
+        float: The value at that percentile, or None if there are no values
+    """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_benchmark(args):
+    """Run the benchmark described by the command line arguments
+
+    Args:
+        args (argparse.Namespace): The parsed command line
+
+    Returns:
+        dict: The results
+    """
+    keywords = make_words(max(args.patterns, 1), seed=2)
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve_pages,
+        args=(port_queue, args.page_size, args.change_rate, args.etag, args.delay, keywords),
+        daemon=True
+    )
+    server.start()
+    port = port_queue.get(timeout=10)
+
+    watchers = [
+        {
+            'Name': f'page-{index}',
+            'URL': f'http://127.0.0.1:{port}/page/{index}',
+            'Whitelist': keywords[:args.patterns // 2],
+            'Blacklist': keywords[args.patterns // 2:args.patterns],
+            'AlertAnyChange': True
+        }
+        for index in range(args.watchers)
+    ]
+    fetch_config = {
+        'max_concurrency': args.max_concurrency,
+        'per_host_concurrency': args.per_host_concurrency,
+        'pool_maxsize': args.per_host_concurrency
+    }
+    # Make every watcher due on every tick
+    schedule_config = {'adaptive': False, 'jitter': 0}
+    manager = WatcherManager(watchers, fetch_config, None, schedule_config, tick_frequency=1e-6)
+
+    profiler = Profiler()
+    profiler.install()
+    ticks = []
+    cpu_start = time.process_time()
+    try:
+        for _ in range(args.ticks):
+            start = time.perf_counter()
+            pages = 0
+            changes = 0
+            for _, change in manager.watch():
+                pages += 1
+                changes += int(change.did_change)
+            wall_time = time.perf_counter() - start
+            ticks.append({
+                'wall_time': wall_time,
+                'pages': pages,
+                'changes': changes,
+                'pages_per_sec': pages / wall_time if wall_time > 0 else None
+            })
+            logger.info(f'Tick took {wall_time:.3f}s for {pages} pages ({changes} changed)')
+    finally:
+        profiler.uninstall()
+        manager.close()
+        server.terminate()
+
+    wall_times = [tick['wall_time'] for tick in ticks]
+    return {
+        'parameters': vars(args),
+        'ticks': ticks,
+        'tick_wall_time_mean': sum(wall_times) / len(wall_times) if wall_times else None,
+        'pages_per_sec': sum(tick['pages'] for tick in ticks) / sum(wall_times) if sum(wall_times) > 0 else None,
+        'fetch_latency_p50': percentile(profiler.fetch_latencies, 0.5),
+        'fetch_latency_p99': percentile(profiler.fetch_latencies, 0.99),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'cpu_time_total': time.process_time() - cpu_start,
+        'cpu_time_decode_and_hash': profiler.scan_cpu - profiler.match_cpu,
+        'cpu_time_match': profiler.match_cpu
+    }
+
+
+def parse_arguments(argv: list=None):
+    """Parse the command line
+
+    Args:
+        argv (list, optional): The arguments to parse. Defaults to None (sys.argv).
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='Benchmark WatcherManager.watch() against a local server')
+    parser.add_argument('--watchers', type=int, default=100, help='How many watchers to run')
+    parser.add_argument('--ticks', type=int, default=5, help='How many ticks to measure')
+    parser.add_argument('--page-size', type=int, default=50000, help='Size of every page, in bytes')
+    parser.add_argument('--change-rate', type=float, default=0.1, help='Chance of a page changing between requests')
+    parser.add_argument('--patterns', type=int, default=50, help='How many words every watcher looks for')
+    parser.add_argument('--etag', action='store_true', help='Make the server send ETags and answer 304')
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds the server waits before answering')
+    parser.add_argument('--max-concurrency', type=int, default=8, help='fetch_config.max_concurrency')
+    parser.add_argument('--per-host-concurrency', type=int, default=8, help='fetch_config.per_host_concurrency')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_arguments()
+    results = run_benchmark(args)
+    summary = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(summary)
+    print(summary)
+
+if __name__ == '__main__':
+    main()
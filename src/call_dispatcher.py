@@ -0,0 +1,152 @@
+"""
+Define the CallDispatcher class, merging changes into as few calls as possible and placing them in the background
+"""
+import time
+import logging
+import threading
+from watcher.metrics import metrics
+
+class CallDispatcher:
+    """ Collect changes for a while and place one call for all of them, from a background thread """
+    def __init__(self, call, sms=None, window: float=60, cooldown: float=300, retries: int=2, backoff: float=5,
+                 max_messages: int=10):
+        """Start the calling thread
+
+        Args:
+            call (callable): Called with a list of messages to place a call, raises on failure
+            sms (callable, optional): Called with a list of messages to text them if the call fails. Defaults to None.
+            window (float, optional): Seconds to wait for more changes after the first one, before calling. Defaults to 60.
+            cooldown (float, optional): Seconds after a call before the same watcher is called about again. Defaults to 300.
+            retries (int, optional): How many times to retry a failed call before falling back to SMS. Defaults to 2.
+            backoff (float, optional): Seconds before the first retry, doubled for every retry. Defaults to 5.
+            max_messages (int, optional): The most messages kept per watcher, the oldest are dropped. Defaults to 10.
+        """
+        self.call = call
+        self.sms = sms
+        self.window = window
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backoff = backoff
+        self.max_messages = max_messages
+        # Messages waiting for a call by watcher name, and when each watcher was last called about
+        self.pending = dict()
+        self.window_end = None
+        self.last_called = dict()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='CallDispatcher', daemon=True)
+        self.thread.start()
+
+
+    def publish(self, watcher_name: str, messages: list):
+        """Queue a watcher's messages for the next call, merged with the ones it already has waiting
+
+        Args:
+            watcher_name (str): The watcher the messages are about
+            messages (list): The messages to say
+        """
+        if len(messages) == 0:
+            return
+        with self.condition:
+            # A page that flaps repeats itself, say every message once
+            merged = list(dict.fromkeys(self.pending.get(watcher_name, []) + list(messages)))
+            self.pending[watcher_name] = merged[-self.max_messages:]
+            if self.window_end is None:
+                self.window_end = time.monotonic() + self.window
+            self.condition.notify()
+
+
+    def ready_time(self, watcher_name: str):
+        """ When a watcher's messages may be called about, must be called with the condition held """
+        ready = self.window_end
+        if watcher_name in self.last_called:
+            ready = max(ready, self.last_called[watcher_name] + self.cooldown)
+        return ready
+
+
+    def take_ready(self, now: float):
+        """Take the messages of every watcher that may be called about, must be called with the condition held
+
+        Args:
+            now (float): The current monotonic time
+
+        Returns:
+            tuple: The ready watchers' names and messages, and when the next watcher will be ready (or None)
+        """
+        ready = []
+        next_ready = None
+        for watcher_name in list(self.pending.keys()):
+            ready_time = self.ready_time(watcher_name)
+            if ready_time <= now:
+                ready.append((watcher_name, self.pending.pop(watcher_name)))
+            elif next_ready is None or ready_time < next_ready:
+                next_ready = ready_time
+        return ready, next_ready
+
+
+    def run(self):
+        """ Place a call whenever the window ends, until closed """
+        while True:
+            with self.condition:
+                while True:
+                    if not self.running:
+                        return
+                    now = time.monotonic()
+                    if self.pending and self.window_end <= now:
+                        ready, next_ready = self.take_ready(now)
+                        if ready:
+                            # Changes that come in from now on (and the watchers still cooling down) wait for the next window
+                            self.window_end = now + self.window if self.pending else None
+                            break
+                        self.condition.wait(next_ready - now)
+                    else:
+                        self.condition.wait(self.window_end - now if self.pending else None)
+            self.deliver(ready)
+
+
+    def deliver(self, ready: list):
+        """Call about the ready watchers, retrying and falling back to SMS if the call keeps failing
+
+        Args:
+            ready (list): (watcher name, messages) pairs
+        """
+        messages = [message for _, watcher_messages in ready for message in watcher_messages]
+        for attempt in range(self.retries + 1):
+            start = metrics.start()
+            try:
+                self.call(messages)
+                if start is not None:
+                    metrics.observe('websitewatcher_notify_seconds', time.perf_counter() - start)
+                break
+            except Exception as exception:
+                metrics.increment('websitewatcher_notify_errors_total')
+                logging.warning(f'Placing a call failed ({exception}), attempt {attempt + 1} of {self.retries + 1}')
+                if attempt < self.retries:
+                    delay = getattr(exception, 'retry_after', None) or self.backoff * (2 ** attempt)
+                    with self.condition:
+                        # Wake up early only to close
+                        self.condition.wait_for(lambda: not self.running, delay)
+                        if not self.running:
+                            return
+        else:
+            if self.sms is None:
+                logging.error(f'Giving up on a call with {len(messages)} messages')
+                return
+            try:
+                self.sms(messages)
+            except Exception as exception:
+                metrics.increment('websitewatcher_notify_errors_total')
+                logging.error(f'Texting {len(messages)} messages after the call failed did not work either: {exception}')
+                return
+        now = time.monotonic()
+        with self.condition:
+            for watcher_name, _ in ready:
+                self.last_called[watcher_name] = now
+
+
+    def close(self):
+        """ Stop the calling thread, dropping the messages that weren't called about """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
@@ -0,0 +1,136 @@
+"""
+Define the ConfigReloader class, applying changes to the watchers in config.json without a restart
+"""
+import os
+import json
+import logging
+import threading
+from configuration import Configuration, InvalidConfiguration
+from watcher.watcher import Watcher
+
+class ConfigReloader:
+    """ Poll config.json for changes and apply its watchers to a running manager """
+    def __init__(self, config_path: str, manager, poll_interval: float=None):
+        """Remember the file's current version, and start polling it if poll_interval is set
+
+        Args:
+            config_path (str): The path for config.json
+            manager (WatcherManager): The manager to apply the watchers to (or a ShardedWatcherManager)
+            poll_interval (float, optional): Seconds between checks of the file. Defaults to None (no polling).
+        """
+        self.config_path = config_path
+        self.manager = manager
+        self.poll_interval = poll_interval
+        # Serializes reloads with the edits of add_watcher and remove_watcher
+        self.lock = threading.RLock()
+        self.version = self.file_version()
+        self.stopped = threading.Event()
+        self.thread = None
+        if poll_interval:
+            self.thread = threading.Thread(target=self.poll, name='ConfigReloader', daemon=True)
+            self.thread.start()
+            logging.info(f'Reloading the watchers from {config_path} when it changes')
+
+
+    def file_version(self):
+        """Get what identifies the file's version without reading it
+
+        Returns:
+            tuple: The file's modification time and size, or None if it is missing
+        """
+        try:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
+    def poll(self):
+        """ Reload the file whenever its version changes, until closed """
+        while not self.stopped.wait(self.poll_interval):
+            if self.file_version() != self.version:
+                try:
+                    self.reload()
+                except Exception:
+                    # Keep polling, the next edit of the file may well apply
+                    logging.exception(f'Applying the watchers of {self.config_path} failed')
+
+
+    def reload(self):
+        """Read the file and apply its watchers, keeping the current ones if it is invalid
+
+        Returns:
+            bool: True if the file was applied
+        """
+        with self.lock:
+            self.version = self.file_version()
+            try:
+                config = Configuration(self.config_path)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError, InvalidConfiguration) as exception:
+                logging.error(f'Not reloading {self.config_path}, it is invalid: {exception}')
+                return False
+            # Only the watchers are applied, the other sections are read once on startup
+            self.manager.apply_watchers(config.watchers_list or [])
+            return True
+
+
+    def edit_watchers(self, edit):
+        """Change the watchers in the file and apply the result right away
+
+        Args:
+            edit (callable): Called with the list of watcher items to change it in place
+        """
+        with self.lock:
+            with open(self.config_path, 'r') as config_file:
+                raw_config = json.load(config_file)
+            edit(raw_config.setdefault('watchers', []))
+            # Write a copy and rename it over the file, so the poller never reads half a file
+            temporary_path = f'{self.config_path}.tmp'
+            with open(temporary_path, 'w') as config_file:
+                json.dump(raw_config, config_file, indent=4, ensure_ascii=False)
+            os.replace(temporary_path, self.config_path)
+            self.reload()
+
+
+    def add_watcher(self, watcher_item: dict):
+        """Add a watcher (or replace the one with the same name) in the file
+
+        Args:
+            watcher_item (dict): The watcher item, as in the config file
+
+        Raises:
+            InvalidWatcherConfiguration: If the item is invalid, in which case the file is not changed
+        """
+        Watcher(watcher_item)
+
+        def edit(watchers_list: list):
+            watchers_list[:] = [item for item in watchers_list if item.get('Name') != watcher_item['Name']]
+            watchers_list.append(watcher_item)
+
+        self.edit_watchers(edit)
+
+
+    def remove_watcher(self, name: str):
+        """Remove a watcher from the file
+
+        Args:
+            name (str): The watcher's name
+
+        Returns:
+            bool: True if there was a watcher with this name
+        """
+        found = []
+
+        def edit(watchers_list: list):
+            found.extend(item for item in watchers_list if item.get('Name') == name)
+            watchers_list[:] = [item for item in watchers_list if item.get('Name') != name]
+
+        self.edit_watchers(edit)
+        return len(found) > 0
+
+
+    def close(self):
+        """ Stop polling the file """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
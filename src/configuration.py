@@ -28,6 +28,13 @@ class Configuration:
         
         # Read the common parts of the configuration
         self.watchers_list = self.from_config('watchers')
+        self.fetch_config = self.from_config('fetch_config') or dict()
+        self.state_config = self.from_config('state_config')
+        self.schedule_config = self.from_config('schedule_config') or dict()
+        self.metrics_config = self.from_config('metrics_config')
+        self.sharding_config = self.from_config('sharding_config')
+        # Seconds between checks of the file for changes to the watchers, None to never reload it
+        self.reload_interval = self.from_config('reload_interval')
 
         # Make sure that exactly one mode is enabled
         if not (self.from_config('mode')['telegram'] ^ self.from_config('mode')['twilio']):
@@ -48,6 +55,9 @@ class Configuration:
         self.token = self.from_config('telegram_config').get('token')
         self.password = self.from_config('telegram_config').get('password')
         self.tick_frequency = self.from_config('telegram_config').get('tick_frequency')
+        self.per_chat_rate = self.from_config('telegram_config').get('per_chat_rate', 1)
+        self.global_rate = self.from_config('telegram_config').get('global_rate', 30)
+        self.send_retries = self.from_config('telegram_config').get('send_retries', 3)
 
 
     def read_twilio_config(self):
@@ -58,4 +68,9 @@ class Configuration:
         self.receiver_number = self.from_config('twilio_config').get('receiver_number')
         self.caller_number = self.from_config('twilio_config').get('caller_number')
         self.tick_frequency = self.from_config('twilio_config').get('tick_frequency')
-        self.debug_mode = self.from_config('twilio_config').get('debug_mode')
\ No newline at end of file
+        self.debug_mode = self.from_config('twilio_config').get('debug_mode')
+        self.aggregation_window = self.from_config('twilio_config').get('aggregation_window', 60)
+        self.cooldown = self.from_config('twilio_config').get('cooldown', 300)
+        self.call_retries = self.from_config('twilio_config').get('call_retries', 2)
+        self.sms_fallback = self.from_config('twilio_config').get('sms_fallback', False)
+        self.api_base_url = self.from_config('twilio_config').get('api_base_url')
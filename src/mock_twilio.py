@@ -0,0 +1,101 @@
+"""
+mock_twilio.py - A local stand-in for the Twilio REST API, to try Twilio mode without placing real calls
+Usage: python mock_twilio.py --port 8099, then set twilio_config.api_base_url to http://127.0.0.1:8099
+"""
+import json
+import uuid
+import logging
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[WebsiteWatcher][%(levelname)s][%(filename)s:%(funcName)s]: %(message)s')
+
+class MockTwilio:
+    """ Accept the calls and messages the Twilio client creates, and remember them """
+    def __init__(self, host: str='127.0.0.1', port: int=0, fail_calls: int=0):
+        """Start serving from a background thread
+
+        Args:
+            host (str, optional): The address to listen on. Defaults to '127.0.0.1'.
+            port (int, optional): The port to listen on, 0 for any free port. Defaults to 0.
+            fail_calls (int, optional): How many calls to answer with an error first, to try the retries and SMS fallback. Defaults to 0.
+        """
+        self.calls = []
+        self.messages = []
+        self.fail_calls = fail_calls
+        self.lock = threading.Lock()
+        mock = self
+
+        class TwilioHandler(BaseHTTPRequestHandler):
+            """ Answer POST /2010-04-01/Accounts/<sid>/Calls.json and .../Messages.json """
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                fields = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+                status, body = mock.handle(self.path, fields)
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), TwilioHandler)
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, name='MockTwilio', daemon=True).start()
+        logging.info(f'Mock Twilio API listening on {self.url}')
+
+
+    def handle(self, path: str, fields: dict):
+        """Record a call or a message
+
+        Args:
+            path (str): The request's path
+            fields (dict): The request's form fields
+
+        Returns:
+            tuple: The HTTP status and the JSON body to answer with
+        """
+        with self.lock:
+            if path.endswith('/Calls.json'):
+                if self.fail_calls > 0:
+                    self.fail_calls -= 1
+                    logging.info('Failing a call on purpose')
+                    return 500, {'code': 20500, 'message': 'Mock failure', 'status': 500}
+                self.calls.append(fields)
+                logging.info(f"Call to {fields.get('To')}: {fields.get('Twiml')}")
+                return 201, {'sid': 'CA' + uuid.uuid4().hex, 'to': fields.get('To'), 'from': fields.get('From'), 'status': 'queued'}
+            if path.endswith('/Messages.json'):
+                self.messages.append(fields)
+                logging.info(f"SMS to {fields.get('To')}: {fields.get('Body')}")
+                return 201, {'sid': 'SM' + uuid.uuid4().hex, 'to': fields.get('To'), 'from': fields.get('From'), 'status': 'queued', 'body': fields.get('Body')}
+        return 404, {'code': 20404, 'message': 'Not found', 'status': 404}
+
+
+    def close(self):
+        """ Stop serving """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Twilio calls and messages API')
+    parser.add_argument('--host', default='127.0.0.1', help='The address to listen on')
+    parser.add_argument('--port', type=int, default=8099, help='The port to listen on')
+    parser.add_argument('--fail-calls', type=int, default=0, help='How many calls to fail first')
+    arguments = parser.parse_args()
+    mock = MockTwilio(arguments.host, arguments.port, arguments.fail_calls)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.close()
+
+
+if __name__ == '__main__':
+    main()
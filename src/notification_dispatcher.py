@@ -0,0 +1,215 @@
+"""
+Define the NotificationDispatcher class, sending messages in the background within rate limits
+"""
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from watcher.metrics import metrics
+
+class TokenBucket:
+    """ Allow up to `rate` events per second, with bursts of up to `capacity` events """
+    def __init__(self, rate: float, capacity: float=1):
+        """Create a full bucket
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (float, optional): The most tokens the bucket holds. Defaults to 1.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+
+    def refill(self, now: float):
+        """ Add the tokens earned since the last refill """
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    def delay(self, now: float=None):
+        """Get how long until a token is available
+
+        Args:
+            now (float, optional): The current monotonic time. Defaults to None (now).
+
+        Returns:
+            float: Seconds to wait, 0 if a token is available
+        """
+        now = time.monotonic() if now is None else now
+        self.refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+    def consume(self):
+        """ Take a token, must only be called when delay() is 0 """
+        self.tokens -= 1
+
+
+def coalesce(lines: list, max_length: int):
+    """Join lines into as few messages as possible, each at most max_length characters long
+
+    Args:
+        lines (list): The lines to send
+        max_length (int): The longest message allowed
+
+    Returns:
+        list: The messages
+    """
+    messages = []
+    current = ''
+    for line in lines:
+        # A single line that is too long is cut into pieces
+        while len(line) > max_length:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(line[:max_length])
+            line = line[max_length:]
+        if not line:
+            continue
+        if current and len(current) + 2 + len(line) > max_length:
+            messages.append(current)
+            current = ''
+        current = f'{current}\n\n{line}' if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+class NotificationDispatcher:
+    """ Send messages from a background thread, so the watch loop never waits for them """
+    def __init__(self, send, per_chat_rate: float=1, global_rate: float=30, max_length: int=4096,
+                 retries: int=3, backoff: float=1, retryable=None):
+        """Start the sending thread
+
+        Args:
+            send (callable): Called with (chat_id, text) to send a message, raises on failure
+            per_chat_rate (float, optional): Messages per second allowed to each chat. Defaults to 1.
+            global_rate (float, optional): Messages per second allowed overall. Defaults to 30.
+            max_length (int, optional): The longest message allowed. Defaults to 4096.
+            retries (int, optional): How many times to retry a failed message. Defaults to 3.
+            backoff (float, optional): Seconds before the first retry, doubled for every retry. Defaults to 1.
+            retryable (callable, optional): Called with the exception of a failed message, True if sending it again
+                may work. Defaults to None (retry every failure).
+        """
+        self.send = send
+        self.per_chat_rate = per_chat_rate
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_buckets = dict()
+        self.max_length = max_length
+        self.retries = retries
+        self.backoff = backoff
+        self.retryable = retryable
+        # Every chat's messages in order as [text, attempt], only the first of a chat is ever sent
+        self.queues = dict()
+        # The chats with messages, as (not before, sequence, chat id)
+        self.ready = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='NotificationDispatcher', daemon=True)
+        self.thread.start()
+
+
+    def publish(self, lines: list, chat_ids: list):
+        """Queue lines to be sent to every one of the chats, in as few messages as possible
+
+        Args:
+            lines (list): The lines to send
+            chat_ids (list): The chats to send them to
+        """
+        if len(lines) == 0 or len(chat_ids) == 0:
+            return
+        messages = coalesce(lines, self.max_length)
+        now = time.monotonic()
+        with self.condition:
+            for chat_id in chat_ids:
+                queue = self.queues.get(chat_id)
+                if queue is None:
+                    # The chat wasn't waiting for anything, it is ready right away
+                    queue = self.queues[chat_id] = deque()
+                    heapq.heappush(self.ready, (now, next(self.counter), chat_id))
+                queue.extend([text, 0] for text in messages)
+            self.condition.notify()
+
+
+    def run(self):
+        """ Send the pending messages as the rate limits allow, until closed """
+        while True:
+            with self.condition:
+                while self.running and (not self.ready or self.ready[0][0] > time.monotonic()):
+                    timeout = self.ready[0][0] - time.monotonic() if self.ready else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                _, _, chat_id = heapq.heappop(self.ready)
+                now = time.monotonic()
+                if chat_id not in self.chat_buckets:
+                    self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+                chat_bucket = self.chat_buckets[chat_id]
+                wait = max(self.global_bucket.delay(now), chat_bucket.delay(now))
+                if wait > 0:
+                    # Come back when the buckets have a token for this chat
+                    heapq.heappush(self.ready, (now + wait, next(self.counter), chat_id))
+                    continue
+                self.global_bucket.consume()
+                chat_bucket.consume()
+                text, attempt = self.queues[chat_id][0]
+            delay = self.deliver(chat_id, text, attempt)
+            with self.condition:
+                queue = self.queues[chat_id]
+                if delay is None:
+                    queue.popleft()
+                    delay = 0
+                else:
+                    # Retry the same message before any later one, so the chat reads them in order
+                    queue[0][1] += 1
+                if queue:
+                    heapq.heappush(self.ready, (time.monotonic() + delay, next(self.counter), chat_id))
+                else:
+                    del self.queues[chat_id]
+
+
+    def deliver(self, chat_id: int, text: str, attempt: int):
+        """Send a message
+
+        Args:
+            chat_id (int): The chat to send to
+            text (str): The message
+            attempt (int): How many times sending it failed before
+
+        Returns:
+            float: Seconds to wait before retrying it, or None if it was sent or given up on
+        """
+        start = metrics.start()
+        try:
+            self.send(chat_id, text)
+            if start is not None:
+                metrics.observe('websitewatcher_notify_seconds', time.perf_counter() - start)
+            return None
+        except Exception as exception:
+            metrics.increment('websitewatcher_notify_errors_total')
+            if self.retryable is not None and not self.retryable(exception):
+                logging.error(f'Could not send a message to {chat_id}, not retrying: {exception}')
+                return None
+            if attempt >= self.retries:
+                logging.error(f'Giving up on a message to {chat_id} after {attempt + 1} attempts: {exception}')
+                return None
+            # Respect the server's own estimate (like Telegram's RetryAfter) when it gives one
+            delay = getattr(exception, 'retry_after', None) or self.backoff * (2 ** attempt)
+            logging.warning(f'Sending a message to {chat_id} failed ({exception}), retrying in {delay} seconds')
+            return delay
+
+
+    def close(self):
+        """ Stop the sending thread, dropping the messages that weren't sent """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
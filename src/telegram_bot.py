@@ -2,39 +2,111 @@
 Define the Telegram bot version of WebsiteWatcher
 """
 
+import json
 import logging
 
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
 from telegram.ext import Updater, CommandHandler
 from watcher.watcher_manager import WatcherManager
+from watcher.watcher import InvalidWatcherConfiguration
+from notification_dispatcher import NotificationDispatcher
+
+# The name of the job that runs the ticks, there is only ever one of them
+TICK_JOB = 'watch_tick'
+
+def is_retryable(exception: Exception):
+    """Check if sending a message again may work after it failed
+
+    Args:
+        exception (Exception): What sending the message raised
+
+    Returns:
+        bool: True for flood control and network errors, False for rejected messages and blocked chats
+    """
+    if isinstance(exception, (RetryAfter, TimedOut)):
+        return True
+    # Telegram reports a rejected message as a BadRequest, which is a NetworkError as well
+    return isinstance(exception, NetworkError) and not isinstance(exception, BadRequest)
 
 class Bot:
     """ A Telegram Bot to watch and alert for URL changes """
     def watch_tick(self, context):
-        """Run a round of WatcherManager and report any changes
+        """Run a round of WatcherManager, report any changes and schedule the next round
 
         Args:
             self (Bot): The bot class
             context (telegram.ext.callbackcontext.CallbackContext): Object used for interaction with Telegram
         """
+        try:
+            self.report_changes(context)
+        finally:
+            # A /stop and /watch during this tick already scheduled the next one
+            if self.watching and not context.job_queue.get_jobs_by_name(TICK_JOB):
+                self.schedule_tick(context.job_queue)
+
+
+    def send_message(self, chat_id: int, text: str):
+        """Send a message to a chat, used by the dispatcher
+
+        Args:
+            chat_id (int): The chat to send to
+            text (str): The message
+        """
+        self.updater.bot.send_message(chat_id=chat_id, text=text)
+
+
+    def report_changes(self, context):
+        """Run a round of WatcherManager and queue a report of the changes for every authorized chat
+
+        Args:
+            context (telegram.ext.callbackcontext.CallbackContext): Object used for interaction with Telegram
+        """
+        lines = []
         for watcher, change in self.manager.watch():
             # Skip the logic if there was no change
             if not change.did_change:
                 logging.debug(f'{watcher.url} did not change')
                 continue
-            # If the page changed, but no new words - alert only if 'AlertAnyChange' was set in the watcher's config
-            if len(change.new_whitelisted) == 0 and len(change.new_blacklisted) == 0:
+            # If the page changed, but no words changed - alert only if 'AlertAnyChange' was set in the watcher's config
+            if not change.has_word_changes():
                 if watcher.alert_any_change:
-                    message = f"🔄 {watcher.url} changed (no new whitelisted/blacklisted words)"
-                    context.bot.send_message(chat_id=context.job.context, text=message)
+                    lines.append(f"🔄 {watcher.url} changed (no new whitelisted/blacklisted words)")
             if len(change.new_whitelisted) > 0:
                 new_words = ', '.join(change.new_whitelisted)
-                message = f"🆕 {watcher.url} changed (These words were added - {new_words})"
-                context.bot.send_message(chat_id=context.job.context, text=message)
-            # BUG: The blacklist isn't about removed words, its the same as the whitelist
+                lines.append(f"🆕 {watcher.url} changed (These words were added - {new_words})")
+            if len(change.removed_whitelisted) > 0:
+                removed_words = ', '.join(change.removed_whitelisted)
+                lines.append(f"➖ {watcher.url} changed (These words were removed - {removed_words})")
             if len(change.new_blacklisted) > 0:
                 new_words = ', '.join(change.new_blacklisted)
-                message = f"❌ {watcher.url} changed (These words were removed - {new_words})"
-                context.bot.send_message(chat_id=context.job.context, text=message)
+                lines.append(f"❌ {watcher.url} changed (These blacklisted words were added - {new_words})")
+            if len(change.removed_blacklisted) > 0:
+                removed_words = ', '.join(change.removed_blacklisted)
+                lines.append(f"✅ {watcher.url} changed (These blacklisted words were removed - {removed_words})")
+            if len(change.text_diff) > 0:
+                lines.append(f"📝 {watcher.url} diff:\n" + '\n'.join(change.text_diff))
+        # The dispatcher sends in the background, merging the tick's changes into as few messages as it can
+        self.dispatcher.publish(lines, list(self.allowed_users.keys()))
+
+
+    def schedule_tick(self, job_queue):
+        """Run the next tick when the next watcher is due
+
+        Args:
+            job_queue (telegram.ext.JobQueue): The bot's job queue
+        """
+        job_queue.run_once(self.watch_tick, self.manager.seconds_until_next_watch(), name=TICK_JOB)
+
+
+    def stop_ticks(self, job_queue):
+        """Stop ticking, letting a tick that is already running finish
+
+        Args:
+            job_queue (telegram.ext.JobQueue): The bot's job queue
+        """
+        self.watching = False
+        for job in job_queue.get_jobs_by_name(TICK_JOB):
+            job.schedule_removal()
 
 
     def start_watching(self, update, context):
@@ -43,8 +115,13 @@ class Bot:
         if self.allowed_users.get(update.message.chat_id, None) is None:
             context.bot.send_message(chat_id=update.message.chat_id, text="Unauthorized user! Please use the /unlock command and supply a password.")
             return
-        context.bot.send_message(chat_id=update.message.chat_id, text=f"Let's go! I will now run every {self.tick_frequency} seconds.")
-        context.job_queue.run_repeating(self.watch_tick, self.tick_frequency, context=update.message.chat_id)
+        # Every authorized chat gets every change, a second tick chain would only check and send twice
+        if self.watching or context.job_queue.get_jobs_by_name(TICK_JOB):
+            context.bot.send_message(chat_id=update.message.chat_id, text='Already watching! Every authorized chat gets the changes.')
+            return
+        context.bot.send_message(chat_id=update.message.chat_id, text=f"Let's go! I will check every page about every {self.tick_frequency} seconds, more often for pages that change a lot.")
+        self.watching = True
+        self.schedule_tick(context.job_queue)
 
 
     def stop_watching(self, update, context):
@@ -54,7 +131,51 @@ class Bot:
             context.bot.send_message(chat_id=update.message.chat_id, text="Unauthorized user! Please use the /unlock command and supply a password.")
             return
         context.bot.send_message(chat_id=update.message.chat_id, text='OK, I will stop running now.')
-        context.job_queue.stop()
+        self.stop_ticks(context.job_queue)
+
+
+    def add_watcher(self, update, context):
+        """ Add a watcher to config.json and start watching it """
+        logging.debug(f'Got /add command from chat id {update.message.chat_id}')
+        if self.allowed_users.get(update.message.chat_id, None) is None:
+            context.bot.send_message(chat_id=update.message.chat_id, text="Unauthorized user! Please use the /unlock command and supply a password.")
+            return
+        usage = 'Usage: /add {name} {url} or /add {watcher JSON, as in config.json}'
+        if self.reloader is None or len(context.args) == 0:
+            context.bot.send_message(chat_id=update.message.chat_id, text=usage)
+            return
+        try:
+            if context.args[0].startswith('{'):
+                watcher_item = json.loads(' '.join(context.args))
+            elif len(context.args) == 2:
+                watcher_item = {
+                    'Name': context.args[0], 'URL': context.args[1],
+                    'Whitelist': [], 'Blacklist': [], 'AlertAnyChange': True
+                }
+            else:
+                context.bot.send_message(chat_id=update.message.chat_id, text=usage)
+                return
+            self.reloader.add_watcher(watcher_item)
+        except (ValueError, TypeError, InvalidWatcherConfiguration) as exception:
+            context.bot.send_message(chat_id=update.message.chat_id, text=f'Could not add the watcher: {exception}')
+            return
+        context.bot.send_message(chat_id=update.message.chat_id, text=f"Now watching {watcher_item['URL']} as {watcher_item['Name']}.")
+
+
+    def remove_watcher(self, update, context):
+        """ Remove a watcher from config.json and stop watching it """
+        logging.debug(f'Got /remove command from chat id {update.message.chat_id}')
+        if self.allowed_users.get(update.message.chat_id, None) is None:
+            context.bot.send_message(chat_id=update.message.chat_id, text="Unauthorized user! Please use the /unlock command and supply a password.")
+            return
+        if self.reloader is None or len(context.args) == 0:
+            context.bot.send_message(chat_id=update.message.chat_id, text='Usage: /remove {name}')
+            return
+        name = ' '.join(context.args)
+        if self.reloader.remove_watcher(name):
+            context.bot.send_message(chat_id=update.message.chat_id, text=f'Stopped watching {name}.')
+        else:
+            context.bot.send_message(chat_id=update.message.chat_id, text=f'There is no watcher named {name}.')
 
 
     def unlock(self, update, context):
@@ -80,7 +201,9 @@ class Bot:
             context.bot.send_message(chat_id=update.message.chat_id, text="Unauthorized user! Please use the /unlock command and supply a password.")
             return
         del self.allowed_users[update.message.chat_id]
-        context.job_queue.stop()
+        # The other authorized chats still get the changes
+        if len(self.allowed_users) == 0:
+            self.stop_ticks(context.job_queue)
         context.bot.send_message(chat_id=update.message.chat_id, text='Logged off and stopped. Bye!')
 
 
@@ -91,7 +214,8 @@ class Bot:
         self.updater.idle()
 
 
-    def __init__(self, watcher_manager: WatcherManager, telegram_token: str, password: str, tick_frequency: int=60):
+    def __init__(self, watcher_manager: WatcherManager, telegram_token: str, password: str, tick_frequency: int=60,
+                 per_chat_rate: float=1, global_rate: float=30, send_retries: int=3, reloader=None):
         """ Initialize the bot
 
         Args:
@@ -99,6 +223,10 @@ class Bot:
             telegram_token (str): The token recieved from @BotFather
             password (str): A password used to authenticate the bot's users
             tick_frequency (int, optional): What is the frequency of checking for updates. Defaults to 60.
+            per_chat_rate (float, optional): Messages per second allowed to each chat. Defaults to 1.
+            global_rate (float, optional): Messages per second allowed overall. Defaults to 30.
+            send_retries (int, optional): How many times to retry a message that failed to send. Defaults to 3.
+            reloader (ConfigReloader, optional): Used by /add and /remove to edit the watchers. Defaults to None.
         """
         logging.debug('Registering with Telegram...')
 
@@ -106,6 +234,9 @@ class Bot:
         self.bot_password = password
         self.tick_frequency = tick_frequency
         self.allowed_users = dict()
+        self.reloader = reloader
+        # Set by /watch, the single tick job only schedules the next one while it is set
+        self.watching = False
 
         updater = Updater(telegram_token)
         updater.dispatcher.add_handler(CommandHandler('unlock', self.unlock, pass_job_queue=True))
@@ -113,4 +244,10 @@ class Bot:
 
         updater.dispatcher.add_handler(CommandHandler('watch', self.start_watching, pass_job_queue=True))
         updater.dispatcher.add_handler(CommandHandler('stop', self.stop_watching, pass_job_queue=True))
-        self.updater = updater
\ No newline at end of file
+        updater.dispatcher.add_handler(CommandHandler('add', self.add_watcher))
+        updater.dispatcher.add_handler(CommandHandler('remove', self.remove_watcher))
+        self.updater = updater
+        self.dispatcher = NotificationDispatcher(
+            self.send_message, per_chat_rate=per_chat_rate, global_rate=global_rate, retries=send_retries,
+            retryable=is_retryable
+        )
\ No newline at end of file
@@ -8,6 +8,7 @@ from twilio.rest import Client
 from twilio.twiml.voice_response import Pause, VoiceResponse, Say
 
 from configuration import Configuration
+from call_dispatcher import CallDispatcher
 from watcher.watcher_manager import WatcherManager
 
 class TwilioWatcher:
@@ -25,12 +26,19 @@ class TwilioWatcher:
         self.receiver = config.receiver_number
         self.caller = config.caller_number
         self.twilio = Client(config.sid, config.auth)
-        self.tick_frequency = config.tick_frequency
+        if config.api_base_url:
+            # Talk to a stand-in such as mock_twilio.py instead of the real API
+            self.twilio.api.base_url = config.api_base_url.rstrip('/')
         self.debug_mode = config.debug_mode
-    
-    
+        # Calls are placed from the dispatcher's thread, so a tick never waits on the API
+        self.dispatcher = CallDispatcher(
+            self.call, self.send_sms if config.sms_fallback else None,
+            window=config.aggregation_window, cooldown=config.cooldown, retries=config.call_retries
+        )
+
+
     def call(self, messages: list):
-        """ Make a call with a TTS made from a list of strings
+        """ Make a call with a TTS made from a list of strings, raising if it can't be placed
 
         Args:
             messages (list): A list of strings to say over the phone call
@@ -54,33 +62,52 @@ class TwilioWatcher:
         logging.debug(response)
         if self.debug_mode:
             return None
-        else:
-            return self.twilio.calls.create(twiml=response, to=self.receiver, from_=self.caller)
+        return self.twilio.calls.create(twiml=response, to=self.receiver, from_=self.caller)
+
+
+    def send_sms(self, messages: list):
+        """ Text a list of strings, used when a call can't be placed
+
+        Args:
+            messages (list): A list of strings to send
+
+        Returns:
+            twilio.messages.Message: Information about the message sent
+        """
+        logging.info(f'Texting {len(messages)} messages instead of calling')
+        body = '\n'.join(messages)
+        logging.debug(body)
+        if self.debug_mode:
+            return None
+        return self.twilio.messages.create(body=body, to=self.receiver, from_=self.caller)
 
 
     def watch_loop(self):
-        """ Run a round of WatcherManager and report changes """
-        messages = []
+        """ Run a round of WatcherManager and hand the changes to the dispatcher """
         for watcher, change in self.manager.watch():
             # Skip the logic if there was no change
             if not change.did_change:
                 logging.debug(f'{watcher.name} did not change')
                 continue
-            # If the page changed, but no new words - alert only if 'AlertAnyChange' was set in the watcher's config
-            if len(change.new_whitelisted) == 0 and len(change.new_blacklisted) == 0:
+            messages = []
+            # If the page changed, but no words changed - alert only if 'AlertAnyChange' was set in the watcher's config
+            if not change.has_word_changes():
                 if watcher.alert_any_change:
                     messages.append(f"{watcher.name} changed (no new whitelisted/blacklisted words)")
             if len(change.new_whitelisted) > 0:
                 new_words = ', '.join(change.new_whitelisted)
                 messages.append(f"{watcher.name} changed (These words were added - {new_words})")
-            # BUG: The blacklist isn't about removed words, its the same as the whitelist
+            if len(change.removed_whitelisted) > 0:
+                removed_words = ', '.join(change.removed_whitelisted)
+                messages.append(f"{watcher.name} changed (These words were removed - {removed_words})")
             if len(change.new_blacklisted) > 0:
                 new_words = ', '.join(change.new_blacklisted)
-                messages.append(f"{watcher.name} changed (These words were removed - {new_words})")
-        
-        # Send a call with all the updates found
-        if len(messages) > 0:
-            self.call(messages)
+                messages.append(f"{watcher.name} changed (These blacklisted words were added - {new_words})")
+            if len(change.removed_blacklisted) > 0:
+                removed_words = ', '.join(change.removed_blacklisted)
+                messages.append(f"{watcher.name} changed (These blacklisted words were removed - {removed_words})")
+            # The dispatcher merges these with the other watchers' changes (and this watcher's earlier ones) into one call
+            self.dispatcher.publish(watcher.name, messages)
 
 
     def run_watcher(self):
@@ -90,6 +117,10 @@ class TwilioWatcher:
             logging.debug('Running a watch loop')
             try:
                 self.watch_loop()
-            finally:
-                logging.debug(f'Sleeping for {self.tick_frequency} seconds')
-                time.sleep(self.tick_frequency)
+            except Exception as exception:
+                # A failed tick must not end the loop, the next one tries again
+                logging.error(f'The watch loop failed: {exception}')
+            # Sleep only until the next watcher is due, the tick's own runtime already counts
+            delay = self.manager.seconds_until_next_watch()
+            logging.debug(f'Sleeping for {delay:.1f} seconds')
+            time.sleep(delay)
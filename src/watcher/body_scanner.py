@@ -0,0 +1,220 @@
+"""
+Define the BodyScanner class
+"""
+import time
+import zlib
+import codecs
+import hashlib
+import logging
+from watcher.metrics import metrics
+from watcher.normalizer import Normalizer
+from watcher.pattern_matcher import PatternMatcher
+
+# How far back a regex hit may start before the end of a chunk and still be found
+DEFAULT_REGEX_OVERLAP: int = 1024
+# The zlib level of captured bodies, which only live until the check ends
+CAPTURE_LEVEL: int = 1
+
+def create_hasher():
+    """Create the hash object used to detect changes in a page
+
+    Returns:
+        hashlib._Hash: An empty 128 bit BLAKE2b hash object, to be updated with the page's bytes
+    """
+    # BLAKE2b is faster than MD5 on 64 bit machines, and needs nothing outside the standard library
+    return hashlib.blake2b(digest_size=16)
+
+
+def create_decoder(encoding: str=None):
+    """Create an incremental decoder for a body
+
+    Args:
+        encoding (str, optional): The body's encoding. Defaults to None (UTF-8).
+
+    Returns:
+        codecs.IncrementalDecoder: The decoder, replacing invalid bytes, for UTF-8 if the encoding is unknown
+    """
+    try:
+        return codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        logging.debug(f'Unknown encoding {encoding}, decoding as UTF-8')
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+class PageScan:
+    """ The result of reading a page """
+    def __init__(self, digest: bytes, hits: dict=None, text: str=None, matches: int=None, body: bytes=None,
+                 encoding: str=None):
+        """Hold the page's hash and, depending on how it was read, its hits or its text
+
+        Args:
+            digest (bytes): The digest used to detect changes
+            hits (dict, optional): The first position of every pattern found, if they were matched while streaming. Defaults to None.
+            text (str, optional): The normalized page, if it was kept. Defaults to None.
+            matches (int, optional): The bitset of the patterns found, if a worker process matched them. Defaults to None.
+            body (bytes, optional): The compressed body, if it was captured while streaming. Defaults to None.
+            encoding (str, optional): The captured body's encoding. Defaults to None (UTF-8).
+        """
+        self.digest = digest
+        self.hits = hits
+        self.text = text
+        self.matches = matches
+        self.body = body
+        self.encoding = encoding
+        # The response's validators, only saved on the watcher once the page's digest is
+        self.etag = None
+        self.last_modified = None
+
+
+    def captured_text(self):
+        """Get the page's text, decompressing the captured body if the text wasn't kept
+
+        Returns:
+            str: The page's text, or None if it was neither kept nor captured
+        """
+        if self.text is not None or self.body is None:
+            return self.text
+        return create_decoder(self.encoding).decode(zlib.decompress(self.body), final=True)
+
+
+class BodyScanner:
+    """ Hash and pattern-match a response body chunk by chunk, in a single pass """
+    def __init__(self, matcher: PatternMatcher, encoding: str=None, max_body_size: int=None,
+                 regex_overlap: int=DEFAULT_REGEX_OVERLAP, normalizer: Normalizer=None, keep_text: bool=False,
+                 capture: bool=False):
+        """Prepare the hasher, the decoder and the matcher for a new body
+
+        A page that has to be normalized can't be hashed before it is complete, so with a normalizer
+        the decoded text is kept (up to max_body_size) and only hashed once it is normalized.
+        Matching it is then left to the caller, for when the hash shows a change.
+
+        Args:
+            matcher (PatternMatcher): The watcher's compiled patterns
+            encoding (str, optional): The body's encoding. Defaults to None (UTF-8).
+            max_body_size (int, optional): Stop reading after this many bytes. Defaults to None (no limit).
+            regex_overlap (int, optional): Characters kept between chunks for regex patterns. Defaults to 1024.
+            normalizer (Normalizer, optional): The watcher's normalizer. Defaults to None.
+            keep_text (bool, optional): Keep the decoded text even without a normalizer, for diffing. Defaults to False.
+            capture (bool, optional): Otherwise keep the body compressed, so the text of a page that turns out
+                to have changed can still be snapshotted. Defaults to False.
+        """
+        self.matcher = matcher
+        self.normalizer = normalizer
+        self.keep_text = keep_text or normalizer is not None
+        self.parts = []
+        self.max_body_size = max_body_size
+        self.hasher = create_hasher()
+        self.encoding = encoding
+        self.decoder = create_decoder(encoding)
+        # Compressing as it streams keeps a fraction of the page in memory, instead of all its text
+        self.compressor = zlib.compressobj(CAPTURE_LEVEL) if capture and not self.keep_text else None
+        self.captured = []
+        # Keep enough of the previous chunk that a hit spanning two chunks is still found
+        if matcher.max_hit_length is None:
+            self.overlap = regex_overlap
+        else:
+            self.overlap = max(matcher.max_hit_length - 1, 0)
+        self.tail = ''
+        self.tail_position = 0
+        # Only the first position of every pattern, so memory doesn't grow with the page
+        self.hits = dict()
+        self.size = 0
+        self.truncated = False
+        # Seconds spent per phase, only measured while metrics are enabled
+        self.timings = dict(decode=0.0, normalize=0.0, hash=0.0, match=0.0, capture=0.0) if metrics.enabled else None
+
+
+    def lap(self, phase: str, start: float):
+        """Add the time since start to a phase
+
+        Args:
+            phase (str): The phase that just ended
+            start (float): When it started
+
+        Returns:
+            float: The current time, for the next phase
+        """
+        now = time.perf_counter()
+        self.timings[phase] += now - start
+        return now
+
+
+    def feed(self, chunk: bytes):
+        """Hash and scan the next chunk of the body
+
+        Args:
+            chunk (bytes): The next bytes of the body
+
+        Returns:
+            bool: False if the body reached the maximal size and the rest should not be read
+        """
+        if self.max_body_size is not None and self.size + len(chunk) >= self.max_body_size:
+            chunk = chunk[:self.max_body_size - self.size]
+            self.truncated = True
+        self.size += len(chunk)
+        timed = self.timings is not None
+        start = time.perf_counter() if timed else None
+        text = self.decoder.decode(chunk, final=self.truncated)
+        if timed:
+            start = self.lap('decode', start)
+        if self.keep_text:
+            self.parts.append(text)
+        if self.normalizer is None:
+            self.hasher.update(chunk)
+            if timed:
+                start = self.lap('hash', start)
+            if self.compressor is not None:
+                self.captured.append(self.compressor.compress(chunk))
+                if timed:
+                    start = self.lap('capture', start)
+            self.scan(text)
+            if timed:
+                self.lap('match', start)
+        return not self.truncated
+
+
+    def scan(self, text: str):
+        """Scan newly decoded text together with the end of the previous one
+
+        Args:
+            text (str): The newly decoded text
+        """
+        if len(text) == 0:
+            return
+        window = self.tail + text
+        # Once every pattern was found the rest of the page can't add anything
+        if len(self.hits) < self.matcher.pattern_count:
+            self.matcher.first_hits(window, self.hits, self.tail_position)
+        keep = min(self.overlap, len(window))
+        self.tail = window[len(window) - keep:]
+        self.tail_position += len(window) - keep
+
+
+    def finish(self):
+        """Flush the decoder and return the results
+
+        Returns:
+            PageScan: The digest of the body, with its hits or its normalized text
+        """
+        if self.truncated:
+            logging.warning(f'Body was larger than {self.max_body_size} bytes, only the start of it was checked')
+        rest = '' if self.truncated else self.decoder.decode(b'', final=True)
+        if self.keep_text:
+            self.parts.append(rest)
+        if self.normalizer is not None:
+            timed = self.timings is not None
+            start = time.perf_counter() if timed else None
+            text = self.normalizer.normalize(''.join(self.parts))
+            if timed:
+                start = self.lap('normalize', start)
+            self.hasher.update(text.encode('utf-8'))
+            if timed:
+                self.lap('hash', start)
+            return PageScan(self.hasher.digest(), text=text)
+        self.scan(rest)
+        text = ''.join(self.parts) if self.keep_text else None
+        body = None
+        if self.compressor is not None:
+            self.captured.append(self.compressor.flush())
+            body = b''.join(self.captured)
+        return PageScan(self.hasher.digest(), hits=self.hits, text=text, body=body, encoding=self.encoding)
@@ -1,17 +1,63 @@
 """
-Define the ChangeEvent class 
+Define the ChangeEvent class
 """
 
 class ChangeEvent:
     """ A class to represents a change in the website """
-    def __init__(self, did_change=False, whitelisted_words=[], blacklisted_words=[]):
+    __slots__ = ('did_change', 'new_whitelisted', 'new_blacklisted', 'removed_whitelisted', 'removed_blacklisted', 'text_diff', 'error')
+
+    def __init__(self, did_change=False, whitelisted_words=(), blacklisted_words=(),
+                 removed_whitelisted_words=(), removed_blacklisted_words=(), text_diff=(), error=None):
         """Hold information about the change in a site
 
         Args:
             did_change (bool, optional): Did the site changed from last time. Defaults to False.
-            whitelisted_words (list, optional): Whitelisted words in the HTML. Defaults to [].
-            blacklisted_words (list, optional): Blacklisted words in the HTML. Defaults to [].
+            whitelisted_words (list, optional): Whitelisted words added to the HTML. Defaults to ().
+            blacklisted_words (list, optional): Blacklisted words added to the HTML. Defaults to ().
+            removed_whitelisted_words (list, optional): Whitelisted words removed from the HTML. Defaults to ().
+            removed_blacklisted_words (list, optional): Blacklisted words removed from the HTML. Defaults to ().
+            text_diff (list, optional): Changed blocks of the page, if the watcher asked for a diff. Defaults to ().
+            error (str, optional): Why the site could not be checked, if it couldn't. Defaults to None.
         """
         self.did_change = did_change
         self.new_whitelisted = whitelisted_words
         self.new_blacklisted = blacklisted_words
+        self.removed_whitelisted = removed_whitelisted_words
+        self.removed_blacklisted = removed_blacklisted_words
+        self.text_diff = text_diff
+        self.error = error
+
+
+    def has_word_changes(self):
+        """Check if any whitelisted or blacklisted word was added or removed
+
+        Returns:
+            bool: True if the matched words changed
+        """
+        return bool(self.new_whitelisted or self.new_blacklisted or self.removed_whitelisted or self.removed_blacklisted)
+
+
+    def to_dict(self):
+        """Turn the event into a JSON-friendly dict, to send it to another process
+
+        Returns:
+            dict: The event's fields
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+    @classmethod
+    def from_dict(cls, fields: dict):
+        """Rebuild an event sent by another process
+
+        Args:
+            fields (dict): A dict returned by to_dict()
+
+        Returns:
+            ChangeEvent: The event
+        """
+        change = cls()
+        for name in cls.__slots__:
+            if name in fields:
+                setattr(change, name, fields[name])
+        return change
@@ -0,0 +1,160 @@
+"""
+Define the CircuitBreaker class, skipping hosts that keep failing or ask us to slow down
+"""
+import time
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from watcher.metrics import metrics
+
+class HostUnavailable(Exception):
+    """ Indicate that a host answered with an error or asked us to come back later """
+    def __init__(self, message: str, retry_after: float=None):
+        """Hold the server's own estimate of when to come back
+
+        Args:
+            message (str): What went wrong
+            retry_after (float, optional): Seconds the server asked us to wait. Defaults to None.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str, now: float=None):
+    """Parse a Retry-After header, given in seconds or as an HTTP date
+
+    Args:
+        value (str): The header's value
+        now (float, optional): The current wall clock time. Defaults to None (now).
+
+    Returns:
+        float: Seconds to wait, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = time.time() if now is None else now
+    return max(date.timestamp() - now, 0)
+
+
+class HostState:
+    """ The breaker state of a single host """
+    def __init__(self):
+        self.failures = 0
+        # While open, the host is skipped until this monotonic time
+        self.open_until = None
+        self.probing = False
+
+
+class CircuitBreaker:
+    """ Track failures per host, skipping a failing host with exponential backoff and probing it with one request """
+    def __init__(self, failure_threshold: int=3, backoff: float=30, max_backoff: float=3600):
+        """Create a breaker with every host closed
+
+        Args:
+            failure_threshold (int, optional): Failures in a row that open a host. Defaults to 3.
+            backoff (float, optional): Seconds a host stays open the first time. Defaults to 30.
+            max_backoff (float, optional): The longest a host stays open, the backoff doubles up to it. Defaults to 3600.
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hosts = dict()
+        # The checks of a tick run on several threads
+        self.lock = threading.Lock()
+
+
+    @classmethod
+    def from_config(cls, fetch_config: dict):
+        """Create a breaker from the 'fetch_config' section of config.json
+
+        Args:
+            fetch_config (dict): The fetch configuration
+
+        Returns:
+            CircuitBreaker: The configured breaker
+        """
+        return cls(
+            failure_threshold=fetch_config.get('breaker_failures', 3),
+            backoff=fetch_config.get('breaker_backoff', 30),
+            max_backoff=fetch_config.get('breaker_max_backoff', 3600)
+        )
+
+
+    def allow(self, host: str, now: float=None):
+        """Check if a request to a host may be sent, taking the probe slot of a host whose backoff is over
+
+        Every allowed request must be followed by record_success(), record_failure() or release().
+
+        Args:
+            host (str): The host
+            now (float, optional): The current monotonic time. Defaults to None (now).
+
+        Returns:
+            bool: True if the request may be sent
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None or state.open_until is None:
+                return True
+            if state.probing or now < state.open_until:
+                return False
+            # Half open, let a single request find out if the host is back
+            state.probing = True
+            return True
+
+
+    def record_success(self, host: str):
+        """Close a host after a successful request
+
+        Args:
+            host (str): The host
+        """
+        with self.lock:
+            state = self.hosts.pop(host, None)
+        if state is not None and state.open_until is not None:
+            logging.info(f'{host} is back, closing its circuit')
+
+
+    def release(self, host: str):
+        """End a request that failed for a reason of our own, without counting it for or against the host
+
+        Args:
+            host (str): The host
+        """
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is not None:
+                # Let the next check probe the host instead
+                state.probing = False
+
+
+    def record_failure(self, host: str, retry_after: float=None, now: float=None):
+        """Count a failed request, opening the host after too many in a row or when it asked us to wait
+
+        Args:
+            host (str): The host
+            retry_after (float, optional): Seconds the server asked us to wait. Defaults to None.
+            now (float, optional): The current monotonic time. Defaults to None (now).
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            state = self.hosts.setdefault(host, HostState())
+            state.failures += 1
+            state.probing = False
+            if retry_after is None and state.failures < self.failure_threshold:
+                return
+            # Double the wait for every failure past the threshold, the failed probes included
+            delay = min(self.backoff * (2 ** min(max(state.failures - self.failure_threshold, 0), 32)), self.max_backoff)
+            if retry_after is not None:
+                delay = max(delay if state.failures >= self.failure_threshold else 0, retry_after)
+            state.open_until = now + delay
+        metrics.increment('websitewatcher_breaker_opened_total')
+        logging.warning(f'Skipping {host} for {delay:g} seconds after {state.failures} failures')
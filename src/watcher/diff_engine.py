@@ -0,0 +1,44 @@
+"""
+Functions used to describe what changed between two checks of a page
+"""
+import re
+import difflib
+
+# Split a page into blocks of text at line breaks and tags, so collapsed pages still diff well
+BLOCK_SPLITTER = re.compile(r'<[^>]*>|\n')
+
+def split_blocks(text: str):
+    """Split a page into the blocks that are compared by diff_text
+
+    Args:
+        text (str): The normalized page
+
+    Returns:
+        list: The non-empty blocks of text in the page, without the tags
+    """
+    return [block.strip() for block in BLOCK_SPLITTER.split(text) if block.strip()]
+
+
+def diff_text(old_text: str, new_text: str, max_blocks: int=20):
+    """Create a compact block-level diff between two versions of a page
+
+    Args:
+        old_text (str): The previous normalized page
+        new_text (str): The current normalized page
+        max_blocks (int, optional): How many changed blocks to report at most. Defaults to 20.
+
+    Returns:
+        list: Changed blocks, prefixed with '-' if removed or '+' if added
+    """
+    old_blocks = split_blocks(old_text)
+    new_blocks = split_blocks(new_text)
+    matcher = difflib.SequenceMatcher(None, old_blocks, new_blocks, autojunk=False)
+    diff = []
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        diff.extend(f'-{block}' for block in old_blocks[old_start:old_end])
+        diff.extend(f'+{block}' for block in new_blocks[new_start:new_end])
+        if len(diff) >= max_blocks:
+            return diff[:max_blocks]
+    return diff
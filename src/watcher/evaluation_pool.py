@@ -0,0 +1,176 @@
+"""
+Define the EvaluationPool class, hashing and matching large pages in worker processes
+"""
+import json
+import logging
+import functools
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ProcessPoolExecutor
+from watcher.body_scanner import BodyScanner, PageScan, create_decoder
+from watcher.normalizer import Normalizer
+from watcher.pattern_matcher import PatternMatcher
+
+@functools.lru_cache(maxsize=1024)
+def compile_spec(spec: tuple):
+    """Compile a watcher's patterns and normalization once per worker process
+
+    Args:
+        spec (tuple): (whitelist, blacklist, use_regex, normalize as JSON), as returned by Watcher.evaluation_spec()
+
+    Returns:
+        tuple: The PatternMatcher and the Normalizer (or None)
+    """
+    whitelist, blacklist, use_regex, normalize_json = spec
+    matcher = PatternMatcher(list(whitelist), list(blacklist), use_regex)
+    normalizer = Normalizer.from_config(json.loads(normalize_json)) if normalize_json is not None else None
+    return matcher, normalizer
+
+
+def evaluate_shared(name: str, size: int, encoding: str, spec: tuple, previous_digest: bytes, chunk_size: int):
+    """Hash and match a page that the manager put in shared memory, runs in a worker process
+
+    Args:
+        name (str): The shared memory block's name
+        size (int): How many bytes of the block hold the page
+        encoding (str): The page's encoding
+        spec (tuple): The watcher's evaluation spec
+        previous_digest (bytes): The watcher's last known digest, to skip matching a normalized page that didn't change
+        chunk_size (int): How many bytes to scan at a time
+
+    Returns:
+        tuple: The page's digest and, unless it is unchanged, the bitset of the patterns found
+    """
+    matcher, normalizer = compile_spec(spec)
+    # The workers share the manager's resource tracker, which forgets the block when the manager unlinks it
+    block = SharedMemory(name=name)
+    try:
+        scanner = BodyScanner(matcher, encoding, normalizer=normalizer)
+        for offset in range(0, size, chunk_size):
+            # Feed slices of the shared block, without copying them out of it
+            with block.buf[offset:min(offset + chunk_size, size)] as chunk:
+                scanner.feed(chunk)
+        page = scanner.finish()
+    finally:
+        block.close()
+    hits = page.hits
+    if hits is None:
+        if page.digest == previous_digest:
+            return page.digest, None
+        hits = matcher.first_hits(page.text)
+    return page.digest, matcher.match_bits(hits)
+
+
+class EvaluationPool:
+    """ Offload the CPU-heavy part of checking large pages to worker processes """
+    def __init__(self, workers: int, min_size: int=262144):
+        """Create the process pool, the processes start on first use
+
+        Args:
+            workers (int): How many worker processes to use
+            min_size (int, optional): Smaller pages are evaluated in-process, as copying them costs more than it saves. Defaults to 262144.
+        """
+        self.min_size = min_size
+        # Spawn, as forking a process that runs fetch threads could copy a held lock
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+    @classmethod
+    def from_config(cls, fetch_config: dict):
+        """Create a pool from the 'fetch_config' section of config.json
+
+        Args:
+            fetch_config (dict): The fetch configuration
+
+        Returns:
+            EvaluationPool: The pool, or None if evaluation_workers is not set
+        """
+        workers = fetch_config.get('evaluation_workers', 0)
+        if not workers:
+            return None
+        logging.info(f'Evaluating large pages in {workers} worker processes')
+        return cls(workers, fetch_config.get('offload_min_size', 262144))
+
+
+    def should_offload(self, content_length: str):
+        """Check if a page is large enough to be worth sending to a worker
+
+        Args:
+            content_length (str): The response's Content-Length header, if it had one
+
+        Returns:
+            bool: True if the page should be evaluated by a worker
+        """
+        try:
+            return content_length is not None and int(content_length) >= self.min_size
+        except ValueError:
+            return False
+
+
+    def evaluate(self, response, watcher, chunk_size: int, max_body_size: int=None, capture: bool=False):
+        """Read a response into shared memory and have a worker evaluate it
+
+        Args:
+            response (requests.Response): The streamed response
+            watcher (Watcher): The watcher the page belongs to
+            chunk_size (int): How many bytes to read at a time
+            max_body_size (int, optional): Stop reading after this many bytes. Defaults to None (no limit).
+            capture (bool, optional): Decode the page's text if it changed, to snapshot it. Defaults to False.
+
+        Returns:
+            tuple: The PageScan and the number of bytes read
+        """
+        capacity = int(response.headers['Content-Length'])
+        if max_body_size is not None:
+            capacity = min(capacity, max_body_size)
+        block = SharedMemory(create=True, size=max(capacity, 1))
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if max_body_size is not None:
+                    chunk = chunk[:max_body_size - size]
+                if size + len(chunk) > block.size:
+                    # A compressed page decodes to more than its Content-Length, move it to a bigger block
+                    block = self.grow(block, size, max(block.size * 2, size + len(chunk)))
+                block.buf[size:size + len(chunk)] = chunk
+                size += len(chunk)
+                if max_body_size is not None and size >= max_body_size:
+                    logging.warning(f'Body was larger than {max_body_size} bytes, only the start of it was checked')
+                    break
+            digest, matches = self.executor.submit(
+                evaluate_shared, block.name, size, response.encoding, watcher.evaluation_spec(), watcher.digest, chunk_size
+            ).result()
+            text = None
+            if capture and digest != watcher.digest:
+                # The page is still in the block, so a changed page's text costs no second request
+                with block.buf[:size] as body:
+                    text = create_decoder(response.encoding).decode(body, final=True)
+                if watcher.normalizer is not None:
+                    text = watcher.normalizer.normalize(text)
+        finally:
+            block.close()
+            block.unlink()
+        return PageScan(digest, matches=matches, text=text), size
+
+
+    def grow(self, block: SharedMemory, used: int, capacity: int):
+        """Move the used part of a shared memory block to a bigger one
+
+        Args:
+            block (SharedMemory): The current block, which is released
+            used (int): How many bytes of it are used
+            capacity (int): The new block's size
+
+        Returns:
+            SharedMemory: The new block
+        """
+        bigger = SharedMemory(create=True, size=capacity)
+        bigger.buf[:used] = block.buf[:used]
+        block.close()
+        block.unlink()
+        return bigger
+
+
+    def close(self):
+        """ Stop the worker processes """
+        self.executor.shutdown(wait=True)
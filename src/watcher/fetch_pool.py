@@ -0,0 +1,63 @@
+"""
+Define the FetchPool class
+"""
+import logging
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class FetchPool:
+    """ Run watcher checks concurrently, bounded by a global and a per-host limit """
+    def __init__(self, max_concurrency: int=8, per_host_concurrency: int=2):
+        """Create the thread pool used to run the checks
+
+        Args:
+            max_concurrency (int, optional): How many checks may run at once. Defaults to 8.
+            per_host_concurrency (int, optional): How many checks may run at once against one host. Defaults to 2.
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_host_concurrency = max(1, per_host_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='WatcherFetch')
+
+
+    def run(self, watchers: list, check):
+        """Run check(watcher) for every watcher and yield the results as they finish
+
+        Watchers are only handed to the thread pool when their host has a free slot,
+        so a host with many URLs never occupies the workers other hosts are waiting for.
+
+        Args:
+            watchers (list): The Watcher objects to check
+            check (callable): The function to run for each watcher
+
+        Yields:
+            tuple: A (watcher, result) pair for every finished check
+        """
+        # Group the watchers per host, keeping the configured order inside each host
+        pending = defaultdict(deque)
+        for watcher in watchers:
+            pending[watcher.host].append(watcher)
+        running_per_host = defaultdict(int)
+        futures = dict()
+
+        while pending or futures:
+            # Hand out as much work as the limits allow
+            for host in list(pending.keys()):
+                queue = pending[host]
+                while queue and len(futures) < self.max_concurrency and running_per_host[host] < self.per_host_concurrency:
+                    watcher = queue.popleft()
+                    futures[self.executor.submit(check, watcher)] = watcher
+                    running_per_host[host] += 1
+                if not queue:
+                    del pending[host]
+
+            done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                watcher = futures.pop(future)
+                running_per_host[watcher.host] -= 1
+                yield watcher, future.result()
+
+
+    def close(self):
+        """ Stop the worker threads once the running checks are done """
+        logging.debug('Shutting down the fetch pool')
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,79 @@
+"""
+Define the HttpSession class
+"""
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class HttpSession:
+    """ A pooled, keep-alive HTTP session shared by all the watchers """
+    def __init__(self, pool_connections: int=10, pool_maxsize: int=10, connect_timeout: float=5,
+                 read_timeout: float=30, retries: int=2, backoff_factor: float=0.5):
+        """Create the session and mount the connection pools on it
+
+        Args:
+            pool_connections (int, optional): How many hosts to keep a connection pool for. Defaults to 10.
+            pool_maxsize (int, optional): How many keep-alive connections to keep per host. Defaults to 10.
+            connect_timeout (float, optional): Seconds to wait for a connection. Defaults to 5.
+            read_timeout (float, optional): Seconds to wait between bytes of the response. Defaults to 30.
+            retries (int, optional): How many times to retry a failed request. Defaults to 2.
+            backoff_factor (float, optional): Exponential backoff factor between retries. Defaults to 0.5.
+        """
+        logging.debug(f'Creating an HTTP session ({pool_connections} pools of {pool_maxsize} connections)')
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            # 429 and 503 come with Retry-After, they reach the circuit breaker instead of being retried here
+            status_forcelist=(500, 502, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+            # Waiting out a Retry-After would hold a fetch thread, the circuit breaker skips the host instead
+            respect_retry_after_header=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+
+    @classmethod
+    def from_config(cls, fetch_config: dict):
+        """Create a session from the 'fetch_config' section of config.json
+
+        Args:
+            fetch_config (dict): The fetch configuration
+
+        Returns:
+            HttpSession: The configured session
+        """
+        return cls(
+            # Every fetch thread may be talking to a different host, keep a pool for each of them
+            pool_connections=max(fetch_config.get('pool_connections', 10), fetch_config.get('max_concurrency', 8)),
+            # Allow at least one connection for every concurrent request to the same host
+            pool_maxsize=max(fetch_config.get('pool_maxsize', 10), fetch_config.get('per_host_concurrency', 2)),
+            connect_timeout=fetch_config.get('connect_timeout', 5),
+            read_timeout=fetch_config.get('read_timeout', 30),
+            retries=fetch_config.get('retries', 2),
+            backoff_factor=fetch_config.get('backoff_factor', 0.5)
+        )
+
+
+    def get(self, url: str, headers: dict=None, stream: bool=False):
+        """Send a GET request over the pooled connections
+
+        Args:
+            url (str): The URL to get
+            headers (dict, optional): Extra headers for the request. Defaults to None.
+            stream (bool, optional): Don't read the body until it is iterated. Defaults to False.
+
+        Returns:
+            requests.Response: The response from the server
+        """
+        return self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+
+
+    def close(self):
+        """ Close all the pooled connections """
+        self.session.close()
@@ -0,0 +1,279 @@
+"""
+Define the Metrics class, collecting hot-path timings and counters and exposing them Prometheus-style
+"""
+import time
+import bisect
+import logging
+import threading
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Upper bounds (in seconds) of the histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_labels(labels: tuple):
+    """Format labels the way Prometheus expects them
+
+    Args:
+        labels (tuple): (label, value) pairs
+
+    Returns:
+        str: The labels in braces, or an empty string if there are none
+    """
+    if len(labels) == 0:
+        return ''
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram:
+    """ Count observations into cumulative buckets """
+    def __init__(self, buckets: tuple=DEFAULT_BUCKETS):
+        """Create an empty histogram
+
+        Args:
+            buckets (tuple, optional): The sorted upper bounds of the buckets. Defaults to DEFAULT_BUCKETS.
+        """
+        self.buckets = buckets
+        # The last slot counts the observations above every bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value: float):
+        """Add an observation
+
+        Args:
+            value (float): The observed value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """ Collect timings and counters from the watch loop, doing nothing while disabled """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = dict()
+        # Per watcher and phase [total seconds, count], kept apart to avoid a histogram per watcher
+        self.watcher_phases = defaultdict(lambda: [0.0, 0])
+        self.log_interval = None
+        self.last_log = time.monotonic()
+        self.server = None
+
+
+    def configure(self, metrics_config: dict):
+        """Enable the metrics described by the 'metrics_config' section of config.json
+
+        Args:
+            metrics_config (dict): The metrics configuration, None to keep them disabled
+        """
+        if not metrics_config or not metrics_config.get('enabled', True):
+            self.enabled = False
+            return
+        self.enabled = True
+        self.log_interval = metrics_config.get('log_interval')
+        port = metrics_config.get('port')
+        if port is not None and self.server is None:
+            self.serve(metrics_config.get('host', '127.0.0.1'), port)
+
+
+    def start(self):
+        """Start timing something
+
+        Returns:
+            float: The start time to pass to the observe methods, or None while disabled
+        """
+        return time.perf_counter() if self.enabled else None
+
+
+    def increment(self, name: str, amount: float=1):
+        """Increment a counter
+
+        Args:
+            name (str): The counter's name
+            amount (float, optional): How much to add. Defaults to 1.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += amount
+
+
+    def observe(self, name: str, value: float, labels: tuple=()):
+        """Add an observation to a histogram
+
+        Args:
+            name (str): The histogram's name
+            value (float): The observed value
+            labels (tuple, optional): (label, value) pairs. Defaults to ().
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            key = (name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+
+    def observe_phase(self, phase: str, watcher_name: str, start: float=None, duration: float=None):
+        """Record how long a phase of checking a watcher took
+
+        Args:
+            phase (str): The phase (connect, download, decode, hash, match, notify...)
+            watcher_name (str): The watcher's name
+            start (float, optional): The value returned by start(). Defaults to None.
+            duration (float, optional): The duration, if it was measured elsewhere. Defaults to None.
+        """
+        if not self.enabled:
+            return
+        if duration is None:
+            if start is None:
+                return
+            duration = time.perf_counter() - start
+        with self.lock:
+            key = ('websitewatcher_phase_seconds', (('phase', phase),))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(duration)
+            totals = self.watcher_phases[(watcher_name, phase)]
+            totals[0] += duration
+            totals[1] += 1
+
+
+    def render(self):
+        """Render every metric in the Prometheus text format
+
+        Returns:
+            str: The metrics page
+        """
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines.append(f'{name} {value}')
+            previous_name = None
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                # Label sets of the same histogram are sorted together, and share one TYPE line
+                if name != previous_name:
+                    lines.append(f'# TYPE {name} histogram')
+                    previous_name = name
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+            if self.watcher_phases:
+                lines.append('# TYPE websitewatcher_watcher_phase_seconds summary')
+            for (watcher_name, phase), (total, count) in sorted(self.watcher_phases.items()):
+                labels = format_labels((('watcher', watcher_name), ('phase', phase)))
+                lines.append(f'websitewatcher_watcher_phase_seconds_sum{labels} {total}')
+                lines.append(f'websitewatcher_watcher_phase_seconds_count{labels} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+    def drain(self):
+        """Take everything collected since the last drain, to be merged into another process' metrics
+
+        Returns:
+            dict: The counters, histograms and watcher phases, as JSON-friendly lists, or None if there are none
+        """
+        with self.lock:
+            if not (self.counters or self.histograms or self.watcher_phases):
+                return None
+            snapshot = {
+                'counters': dict(self.counters),
+                'histograms': [
+                    [name, [list(label) for label in labels], histogram.counts, histogram.sum, histogram.count]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+                'phases': [[watcher_name, phase, total, count] for (watcher_name, phase), (total, count) in self.watcher_phases.items()]
+            }
+            self.counters.clear()
+            self.histograms.clear()
+            self.watcher_phases.clear()
+        return snapshot
+
+
+    def merge(self, snapshot: dict):
+        """Add the metrics drained in another process
+
+        Args:
+            snapshot (dict): A snapshot returned by drain()
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            for name, value in snapshot['counters'].items():
+                self.counters[name] += value
+            for name, labels, counts, total, count in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                histogram = self.histograms[key]
+                histogram.counts = [mine + theirs for mine, theirs in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+            for watcher_name, phase, total, count in snapshot['phases']:
+                totals = self.watcher_phases[(watcher_name, phase)]
+                totals[0] += total
+                totals[1] += count
+
+
+    def serve(self, host: str, port: int):
+        """Expose the metrics on http://host:port/metrics from a background thread
+
+        Args:
+            host (str): The address to listen on
+            port (int): The port to listen on
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            """ Answer scrapes of /metrics """
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name='Metrics', daemon=True).start()
+        logging.info(f'Serving metrics on http://{host}:{self.server.server_address[1]}/metrics')
+
+
+    def maybe_log_summary(self):
+        """ Log a summary of the metrics, if log_interval seconds passed since the last one """
+        if not self.enabled or not self.log_interval:
+            return
+        now = time.monotonic()
+        if now - self.last_log < self.log_interval:
+            return
+        self.last_log = now
+        with self.lock:
+            counters = ', '.join(f'{name}={value:g}' for name, value in sorted(self.counters.items()))
+            slowest = sorted(self.watcher_phases.items(), key=lambda item: item[1][0], reverse=True)[:5]
+        logging.info(f'Metrics: {counters}')
+        for (watcher_name, phase), (total, count) in slowest:
+            logging.info(f'Metrics: {watcher_name} spent {total:.3f}s in {phase} over {count} checks')
+
+
+# The process-wide metrics, disabled until configured
+metrics = Metrics()
@@ -0,0 +1,102 @@
+"""
+Define the Normalizer class
+"""
+import re
+import json
+import threading
+import weakref
+
+# Normalizers by their configuration, shared by every watcher configured the same while any of them exists
+SHARED_NORMALIZERS = weakref.WeakValueDictionary()
+SHARED_NORMALIZERS_LOCK = threading.Lock()
+
+class Normalizer:
+    """ Remove the dynamic noise from a page, so only real changes change its hash """
+    def __init__(self, strip_tags: list=('script', 'style'), masks: list=(), region: str=None,
+                 collapse_whitespace: bool=True):
+        """Compile the normalization steps into as few regexes as possible
+
+        Args:
+            strip_tags (list, optional): Tags removed along with their content. Defaults to ('script', 'style').
+            masks (list, optional): Regexes for noise to remove (tokens, timestamps...). Defaults to ().
+            region (str, optional): Regex for the part of the page to keep, its first group if it has one. Defaults to None.
+            collapse_whitespace (bool, optional): Turn every run of whitespace into one space. Defaults to True.
+
+        Raises:
+            re.error: If one of the regexes is invalid, or a mask matches the empty string
+        """
+        self.region = re.compile(region, re.DOTALL) if region else None
+        for mask in masks:
+            # Collapsed into runs of noise, an empty match would repeat forever at the same place
+            if re.compile(mask).match('') is not None:
+                raise re.error('a mask must not match the empty string', pattern=mask)
+        # Tags match across lines and in any case, the masks keep the flags their authors wrote them with
+        noise = [rf'(?is:<{tag}\b[^>]*>.*?</{tag}\s*>)' for tag in strip_tags] + [f'(?:{mask})' for mask in masks]
+        self.collapse_whitespace = collapse_whitespace
+        if collapse_whitespace:
+            # Removed noise becomes whitespace, so both collapse into a single space in the same pass
+            noise.append(r'\s')
+            self.noise = re.compile('(?:' + '|'.join(noise) + ')+')
+            self.replacement = ' '
+        elif noise:
+            self.noise = re.compile('|'.join(noise))
+            self.replacement = ''
+        else:
+            self.noise = None
+
+
+    @classmethod
+    def from_config(cls, normalize_item: dict):
+        """Create a normalizer from the 'Normalize' key of a watcher in config.json
+
+        Args:
+            normalize_item (dict): The normalization configuration
+
+        Returns:
+            Normalizer: The configured normalizer
+        """
+        return cls(
+            strip_tags=normalize_item.get('StripTags', ['script', 'style']),
+            masks=normalize_item.get('Masks', []),
+            region=normalize_item.get('Region'),
+            collapse_whitespace=normalize_item.get('CollapseWhitespace', True)
+        )
+
+
+    def normalize(self, text: str):
+        """Normalize a page
+
+        Args:
+            text (str): The page as it was downloaded
+
+        Returns:
+            str: The part of the page we care about, without the noise
+        """
+        if self.region is not None:
+            text = '\n'.join(
+                match.group(1) if match.re.groups > 0 else match.group(0)
+                for match in self.region.finditer(text)
+            )
+        if self.noise is not None:
+            text = self.noise.sub(self.replacement, text)
+        return text.strip() if self.collapse_whitespace else text
+
+
+def shared_normalizer(normalize_json: str):
+    """Get a normalizer for the configuration, reusing the one of another watcher configured the same
+
+    Args:
+        normalize_json (str): The 'Normalize' key of a watcher, as JSON with sorted keys
+
+    Raises:
+        re.error: If one of the regexes is invalid
+
+    Returns:
+        Normalizer: The shared normalizer
+    """
+    with SHARED_NORMALIZERS_LOCK:
+        normalizer = SHARED_NORMALIZERS.get(normalize_json)
+        if normalizer is None:
+            normalizer = Normalizer.from_config(json.loads(normalize_json))
+            SHARED_NORMALIZERS[normalize_json] = normalizer
+    return normalizer
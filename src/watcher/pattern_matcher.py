@@ -0,0 +1,238 @@
+"""
+Define the PatternMatcher class
+"""
+import re
+import threading
+import weakref
+
+# Matchers by their lists, shared by every watcher with the same lists while any of them exists
+SHARED_MATCHERS = weakref.WeakValueDictionary()
+SHARED_MATCHERS_LOCK = threading.Lock()
+
+def compile_literal_trie(words: list):
+    """Build a regex from a trie of the given words
+
+    A trie shaped regex only tries the branches that share the next character,
+    so one scan costs about the same no matter how many words there are.
+
+    Args:
+        words (list): The literal words to match
+
+    Returns:
+        str: A regex matching any of the words, preferring the longest one
+    """
+    trie = dict()
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, dict())
+        # An empty key marks the end of a word
+        node[''] = True
+
+    def build(node: dict):
+        ends_here = '' in node
+        branches = [re.escape(char) + build(node[char]) for char in sorted(key for key in node if key)]
+        if len(branches) == 0:
+            return ''
+        if len(branches) == 1 and not ends_here:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        # The branches are greedy, so the longest word wins and shorter ones are found by their prefixes
+        return group + '?' if ends_here else group
+
+    return build(trie)
+
+
+class PatternMatcher:
+    """ Find every whitelisted and blacklisted pattern in a page with a single scan """
+    def __init__(self, whitelist: list, blacklist: list, use_regex: bool=False):
+        """Compile the watcher's lists into one regex
+
+        Args:
+            whitelist (list): The whitelisted patterns
+            blacklist (list): The blacklisted patterns
+            use_regex (bool, optional): Treat the patterns as regexes instead of literal words. Defaults to False.
+
+        Raises:
+            re.error: If one of the patterns is an invalid regex
+        """
+        self.whitelist = tuple(whitelist)
+        self.blacklist = tuple(blacklist)
+        self.use_regex = use_regex
+        # Every pattern's bits in a match bitset, whitelist entries first (a pattern on both lists has two bits)
+        self.bits = dict()
+        for index, pattern in enumerate(self.whitelist + self.blacklist):
+            self.bits[pattern] = self.bits.get(pattern, 0) | (1 << index)
+        self.whitelist_mask = (1 << len(self.whitelist)) - 1
+        patterns = list(dict.fromkeys(self.whitelist + self.blacklist))
+        self.pattern_count = len(patterns)
+        # The longest text a hit can span, unknown for regexes
+        self.max_hit_length = None if use_regex else max((len(pattern) for pattern in patterns), default=0)
+        self.regex = None
+        if len(patterns) == 0:
+            return
+
+        if use_regex:
+            # Name every alternative so we know which pattern matched
+            self.group_names = {f'p{index}': index for index in range(len(patterns))}
+            # Used to check the patterns after the one the alternation picked at a position
+            self.patterns = patterns
+            self.compiled = [re.compile(pattern) for pattern in patterns]
+            alternatives = '|'.join(f'(?P<{name}>{patterns[index]})' for name, index in self.group_names.items())
+            # Wrap in a lookahead so overlapping hits are found as well
+            self.regex = re.compile(f'(?=(?:{alternatives}))')
+        else:
+            # Literals that are prefixes of a longer literal match wherever the longer one does
+            self.prefixes = {
+                word: [other for other in patterns if other != word and word.startswith(other)]
+                for word in patterns
+            }
+            self.regex = re.compile(f'(?=({compile_literal_trie(patterns)}))')
+
+
+    def iter_hits(self, text: str):
+        """Find every hit of every pattern in the text, one at a time
+
+        In regex mode the alternation only reports the first pattern matching at a position,
+        so the patterns after it are checked at that position on their own.
+
+        Args:
+            text (str): The text to scan
+
+        Yields:
+            tuple: A (pattern, position) pair for every hit
+        """
+        if self.regex is None:
+            return
+        for match in self.regex.finditer(text):
+            position = match.start()
+            if self.use_regex:
+                index = self.group_names[match.lastgroup]
+                yield self.patterns[index], position
+                for other in range(index + 1, len(self.patterns)):
+                    if self.compiled[other].match(text, position):
+                        yield self.patterns[other], position
+            else:
+                word = match.group(1)
+                yield word, position
+                for prefix in self.prefixes[word]:
+                    yield prefix, position
+
+
+    def first_hits(self, text: str, found: dict=None, offset: int=0):
+        """Find where every pattern first appears in the text, without keeping the other hits
+
+        Args:
+            text (str): The text to scan
+            found (dict, optional): Patterns already found, by their first position, updated in place. Defaults to None.
+            offset (int, optional): Added to the positions, for text that doesn't start the page. Defaults to 0.
+
+        Returns:
+            dict: The first position of every pattern found, in the order they were found
+        """
+        found = dict() if found is None else found
+        for pattern, position in self.iter_hits(text):
+            if pattern not in found:
+                found[pattern] = offset + position
+        return found
+
+
+    def split_hits(self, hits: dict):
+        """Sort hits into the whitelisted and blacklisted patterns that were found
+
+        Args:
+            hits (dict): The first position of every pattern found, as returned by first_hits()
+
+        Returns:
+            tuple: The whitelisted and blacklisted patterns found, in the configured order
+        """
+        whitelisted = [pattern for pattern in self.whitelist if pattern in hits]
+        blacklisted = [pattern for pattern in self.blacklist if pattern in hits]
+        return whitelisted, blacklisted
+
+
+    def match_bits(self, hits: dict):
+        """Turn hits into a bitset of the patterns that were found
+
+        Args:
+            hits (dict): The first position of every pattern found, as returned by first_hits()
+
+        Returns:
+            int: Bit i is set if the i-th pattern (whitelist, then blacklist) was found
+        """
+        bits = 0
+        for pattern in hits:
+            bits |= self.bits[pattern]
+        return bits
+
+
+    def bits_of(self, whitelisted: list, blacklisted: list):
+        """Turn lists of found patterns (like the ones saved in the state) into a bitset
+
+        Args:
+            whitelisted (list): The whitelisted patterns found
+            blacklisted (list): The blacklisted patterns found
+
+        Returns:
+            int: The bitset, without the patterns that are no longer in the lists
+        """
+        whitelisted = set(whitelisted)
+        blacklisted = set(blacklisted)
+        bits = 0
+        for index, pattern in enumerate(self.whitelist):
+            if pattern in whitelisted:
+                bits |= 1 << index
+        for index, pattern in enumerate(self.blacklist):
+            if pattern in blacklisted:
+                bits |= 1 << (len(self.whitelist) + index)
+        return bits
+
+
+    def split_bits(self, bits: int):
+        """Turn a bitset back into the whitelisted and blacklisted patterns
+
+        Args:
+            bits (int): A bitset returned by match_bits()
+
+        Returns:
+            tuple: The whitelisted and blacklisted patterns in the bitset, in the configured order
+        """
+        whitelisted = [pattern for index, pattern in enumerate(self.whitelist) if bits >> index & 1]
+        blacklisted = bits >> len(self.whitelist)
+        blacklisted = [pattern for index, pattern in enumerate(self.blacklist) if blacklisted >> index & 1]
+        return whitelisted, blacklisted
+
+
+    def search(self, text: str):
+        """Return the whitelisted and blacklisted patterns that appear in the text
+
+        Args:
+            text (str): The text to look for the patterns in
+
+        Returns:
+            tuple: The whitelisted and blacklisted patterns found, in the configured order
+        """
+        return self.split_hits(self.first_hits(text))
+
+
+def shared_matcher(whitelist: list, blacklist: list, use_regex: bool=False):
+    """Get a matcher for the lists, reusing the one of another watcher with the same lists
+
+    Args:
+        whitelist (list): The whitelisted patterns
+        blacklist (list): The blacklisted patterns
+        use_regex (bool, optional): Treat the patterns as regexes instead of literal words. Defaults to False.
+
+    Raises:
+        re.error: If one of the patterns is an invalid regex
+
+    Returns:
+        PatternMatcher: The shared matcher
+    """
+    key = (tuple(whitelist), tuple(blacklist), bool(use_regex))
+    with SHARED_MATCHERS_LOCK:
+        matcher = SHARED_MATCHERS.get(key)
+        if matcher is None:
+            matcher = PatternMatcher(key[0], key[1], key[2])
+            SHARED_MATCHERS[key] = matcher
+    return matcher
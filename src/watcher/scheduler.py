@@ -0,0 +1,171 @@
+"""
+Define the WatchScheduler class
+"""
+import heapq
+import itertools
+import random
+import time
+from watcher.metrics import metrics
+
+class ScheduleEntry:
+    """ The schedule of a single watcher """
+    def __init__(self, watcher, interval: float, due: float):
+        """Hold the watcher's current interval and next due time
+
+        Args:
+            watcher (Watcher): The scheduled watcher
+            interval (float): The current interval between checks, in seconds
+            due (float): When the next check is due (monotonic time, without jitter)
+        """
+        self.watcher = watcher
+        self.base_interval = interval
+        self.interval = interval
+        self.due = due
+        self.fire_time = due
+        self.removed = False
+
+
+class WatchScheduler:
+    """ Decide when every watcher should be checked, adapting to how often its page changes """
+    def __init__(self, default_interval: float=60, adaptive: bool=True, min_factor: float=0.25,
+                 max_factor: float=8, change_factor: float=0.5, backoff_factor: float=1.5, jitter: float=0.1):
+        """Create an empty schedule
+
+        Args:
+            default_interval (float, optional): Interval for watchers that don't set their own. Defaults to 60.
+            adaptive (bool, optional): Adapt the intervals to how often the pages change. Defaults to True.
+            min_factor (float, optional): Shortest interval, relative to the configured one. Defaults to 0.25.
+            max_factor (float, optional): Longest interval, relative to the configured one. Defaults to 8.
+            change_factor (float, optional): Multiply the interval by this after a change. Defaults to 0.5.
+            backoff_factor (float, optional): Multiply the interval by this after no change. Defaults to 1.5.
+            jitter (float, optional): Random delay added to every check, relative to the interval. Defaults to 0.1.
+        """
+        self.default_interval = default_interval
+        self.adaptive = adaptive
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.change_factor = change_factor
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        # Keyed by watcher name, like the state store
+        self.entries = dict()
+        self.heap = []
+        # Breaks ties in the heap, so watchers themselves are never compared
+        self.counter = itertools.count()
+
+
+    @classmethod
+    def from_config(cls, schedule_config: dict, default_interval: float):
+        """Create a scheduler from the 'schedule_config' section of config.json
+
+        Args:
+            schedule_config (dict): The schedule configuration
+            default_interval (float): The mode's tick_frequency
+
+        Returns:
+            WatchScheduler: The configured scheduler
+        """
+        return cls(
+            default_interval=default_interval,
+            adaptive=schedule_config.get('adaptive', True),
+            min_factor=schedule_config.get('min_factor', 0.25),
+            max_factor=schedule_config.get('max_factor', 8),
+            change_factor=schedule_config.get('change_factor', 0.5),
+            backoff_factor=schedule_config.get('backoff_factor', 1.5),
+            jitter=schedule_config.get('jitter', 0.1)
+        )
+
+
+    def push(self, entry: ScheduleEntry):
+        """ Put the entry in the heap at its due time plus some jitter """
+        entry.fire_time = entry.due + random.uniform(0, self.jitter * entry.interval)
+        heapq.heappush(self.heap, (entry.fire_time, next(self.counter), entry))
+
+
+    def add(self, watcher, now: float=None):
+        """Schedule a watcher, due right away
+
+        Args:
+            watcher (Watcher): The watcher to schedule
+            now (float, optional): The current monotonic time. Defaults to None (now).
+        """
+        now = time.monotonic() if now is None else now
+        self.remove(watcher)
+        entry = ScheduleEntry(watcher, watcher.interval or self.default_interval, now)
+        self.entries[watcher.name] = entry
+        self.push(entry)
+
+
+    def remove(self, watcher):
+        """Stop scheduling a watcher
+
+        Args:
+            watcher (Watcher): The watcher to remove
+        """
+        entry = self.entries.pop(watcher.name, None)
+        if entry is not None:
+            # Removing from the middle of a heap is expensive, so the entry is dropped when it is popped
+            entry.removed = True
+
+
+    def pop_due(self, now: float=None):
+        """Take the watchers that are due out of the schedule
+
+        Every watcher returned must be given back with reschedule().
+
+        Args:
+            now (float, optional): The current monotonic time. Defaults to None (now).
+
+        Returns:
+            list: The due watchers, most overdue first
+        """
+        now = time.monotonic() if now is None else now
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            fire_time, _, entry = heapq.heappop(self.heap)
+            if not entry.removed:
+                metrics.observe('websitewatcher_scheduler_lag_seconds', now - fire_time)
+                due.append(entry.watcher)
+        return due
+
+
+    def reschedule(self, watcher, changed: bool, now: float=None):
+        """Schedule the next check of a watcher that was just checked
+
+        Args:
+            watcher (Watcher): The watcher that was checked
+            changed (bool): Whether its page changed, None if it couldn't be checked (which keeps its interval)
+            now (float, optional): The current monotonic time. Defaults to None (now).
+        """
+        entry = self.entries.get(watcher.name)
+        if entry is None or entry.watcher is not watcher:
+            return
+        now = time.monotonic() if now is None else now
+        if self.adaptive and changed is not None:
+            factor = self.change_factor if changed else self.backoff_factor
+            entry.interval = min(
+                max(entry.interval * factor, entry.base_interval * self.min_factor),
+                entry.base_interval * self.max_factor
+            )
+        # Step from the previous due time rather than from now, so the schedule doesn't drift,
+        # but skip the missed slots instead of bursting to catch up
+        entry.due = max(entry.due + entry.interval, now)
+        self.push(entry)
+
+
+    def seconds_until_due(self, now: float=None):
+        """Get the time until the next watcher is due
+
+        Args:
+            now (float, optional): The current monotonic time. Defaults to None (now).
+
+        Returns:
+            float: Seconds until the next check, or the default interval if nothing is scheduled
+        """
+        now = time.monotonic() if now is None else now
+        # Drop removed entries so they don't wake us up for nothing
+        while self.heap and self.heap[0][2].removed:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return self.default_interval
+        return max(self.heap[0][0] - now, 0)
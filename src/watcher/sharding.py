@@ -0,0 +1,423 @@
+"""
+Split the watchers between worker processes (or nodes) with consistent hashing
+"""
+import json
+import queue
+import bisect
+import socket
+import hashlib
+import logging
+import threading
+import multiprocessing
+from watcher.change_event import ChangeEvent
+from watcher.metrics import metrics
+from watcher.state_store import InvalidStateStoreConfiguration
+from watcher.watcher_manager import WatcherManager
+from watcher.watcher_utils import read_watchers_from_config, unique_watcher_items
+
+def ring_hash(key: str):
+    """Hash a key onto the ring
+
+    Args:
+        key (str): The key to hash
+
+    Returns:
+        int: A 64 bit position on the ring
+    """
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def watcher_key(watcher_item: dict):
+    """Get the key a watcher is sharded by
+
+    Args:
+        watcher_item (dict): A watcher item, as in the config file
+
+    Returns:
+        str: The key, made from the watcher's name and URL
+    """
+    return f"{watcher_item.get('Name')}|{watcher_item.get('URL')}"
+
+
+class HashRing:
+    """ A consistent hash ring, so adding or removing a worker only moves the watchers it gains or loses """
+    def __init__(self, nodes: list=(), replicas: int=100):
+        """Create the ring
+
+        Args:
+            nodes (list, optional): The initial worker ids. Defaults to ().
+            replicas (int, optional): Points per worker on the ring, more spread the load more evenly. Defaults to 100.
+        """
+        self.replicas = replicas
+        self.points = []
+        self.owners = dict()
+        for node in nodes:
+            self.add(node)
+
+
+    def add(self, node: str):
+        """Add a worker to the ring
+
+        Args:
+            node (str): The worker's id
+        """
+        for replica in range(self.replicas):
+            point = ring_hash(f'{node}#{replica}')
+            self.owners[point] = node
+            bisect.insort(self.points, point)
+
+
+    def remove(self, node: str):
+        """Remove a worker from the ring
+
+        Args:
+            node (str): The worker's id
+        """
+        self.points = [point for point in self.points if self.owners[point] != node]
+        self.owners = {point: owner for point, owner in self.owners.items() if owner != node}
+
+
+    def get(self, key: str):
+        """Find the worker that owns a key
+
+        Args:
+            key (str): The key
+
+        Returns:
+            str: The owning worker's id, or None if the ring is empty
+        """
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, ring_hash(key)) % len(self.points)
+        return self.owners[self.points[index]]
+
+
+    def assign(self, watchers_list: list):
+        """Split watcher items between the workers
+
+        Args:
+            watchers_list (list): Watcher items, as in the config file
+
+        Returns:
+            dict: The watcher items of every worker, by worker id, empty if the ring has no workers
+        """
+        if not self.points:
+            return dict()
+        shards = {node: [] for node in set(self.owners.values())}
+        # Every name is watched once, by the first watcher with it
+        for watcher_item in unique_watcher_items(watchers_list):
+            shards[self.get(watcher_key(watcher_item))].append(watcher_item)
+        return shards
+
+
+class QueueEventSink:
+    """ Send change events and metrics to the notifier through a multiprocessing queue """
+    def __init__(self, events: multiprocessing.Queue):
+        self.events = events
+
+
+    def send(self, watcher_name: str, change: ChangeEvent):
+        self.events.put(('change', watcher_name, change.to_dict()))
+
+
+    def send_metrics(self, snapshot: dict):
+        self.events.put(('metrics', None, snapshot))
+
+
+class SocketEventSink:
+    """ Send change events to a notifier on another node, as JSON lines over TCP """
+    def __init__(self, address: str):
+        """Remember where the notifier is, connecting on the first event
+
+        Args:
+            address (str): The notifier's host:port
+        """
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.connection = None
+
+
+    def send(self, watcher_name: str, change: ChangeEvent):
+        line = json.dumps({'watcher': watcher_name, 'event': change.to_dict()}) + '\n'
+        # Reconnect once if the notifier restarted since the last event
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self.connection = socket.create_connection(self.address, timeout=10)
+                self.connection.sendall(line.encode('utf-8'))
+                return
+            except OSError as exception:
+                self.connection = None
+                if attempt == 1:
+                    logging.error(f'Could not send the change of {watcher_name} to the notifier: {exception}')
+
+
+class SocketEventSource:
+    """ Receive change events from the workers on other nodes """
+    def __init__(self, address: str, events: queue.Queue):
+        """Listen for workers in a background thread
+
+        Args:
+            address (str): The host:port to listen on
+            events (queue.Queue): Where to put the received ('change', watcher name, event fields) tuples
+        """
+        host, port = address.rsplit(':', 1)
+        self.events = events
+        self.server = socket.create_server((host, int(port)))
+        threading.Thread(target=self.accept, name='ShardEvents', daemon=True).start()
+        logging.info(f'Waiting for shard workers on {address}')
+
+
+    def accept(self):
+        """ Accept worker connections until the socket is closed """
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.receive, args=(connection,), daemon=True).start()
+
+
+    def receive(self, connection: socket.socket):
+        """Read the events a worker sends
+
+        Args:
+            connection (socket.socket): The worker's connection
+        """
+        with connection, connection.makefile('r', encoding='utf-8') as lines:
+            for line in lines:
+                try:
+                    message = json.loads(line)
+                    self.events.put(('change', message['watcher'], message['event']))
+                except (ValueError, KeyError):
+                    logging.warning('Got an invalid event from a shard worker')
+
+
+    def close(self):
+        self.server.close()
+
+
+class NodeShard:
+    """ Apply reloaded watchers to a remote node, keeping only the node's own shard of them """
+    def __init__(self, manager: WatcherManager, ring: HashRing, node_id: str):
+        """Wrap the node's manager
+
+        Args:
+            manager (WatcherManager): The manager watching the node's shard
+            ring (HashRing): The ring of every node
+            node_id (str): This node's id
+        """
+        self.manager = manager
+        self.ring = ring
+        self.node_id = node_id
+
+
+    def apply_watchers(self, watchers: list):
+        """Change the watched watchers to the node's shard of a new list
+
+        Args:
+            watchers (list): The complete list of watcher items, as in the config file
+
+        Returns:
+            tuple: The names of the added, removed and changed watchers
+        """
+        return self.manager.apply_watchers(self.ring.assign(watchers).get(self.node_id, []))
+
+
+def run_shard_worker(node_id: str, watchers_list: list, sink, manager_args: tuple=(), control=None,
+                     poll_interval: float=1, forward_metrics: bool=False, on_start=None):
+    """Watch one shard, sending every change to the notifier
+
+    Args:
+        node_id (str): The worker's id
+        watchers_list (list): The watcher items of this shard
+        sink (QueueEventSink): Where to send the changes (or a SocketEventSink)
+        manager_args (tuple, optional): The WatcherManager arguments after the watchers list. Defaults to ().
+        control (multiprocessing.Queue, optional): Receives ('set', watchers_list) on rebalance and ('stop', None). Defaults to None.
+        poll_interval (float, optional): Longest time between checks of the control queue. Defaults to 1.
+        forward_metrics (bool, optional): Collect metrics and send them to the notifier with the sink. Defaults to False.
+        on_start (callable, optional): Called with the worker's WatcherManager once it exists, returns an object
+            to close when the worker stops (like a ConfigReloader) or None. Defaults to None.
+    """
+    logging.info(f'Shard worker {node_id} starting with {len(watchers_list)} watchers')
+    if forward_metrics:
+        metrics.configure({'enabled': True})
+        # A forked worker starts with a copy of the notifier's metrics, which must not be sent back
+        metrics.drain()
+    manager = WatcherManager(watchers_list, *manager_args)
+    started = on_start(manager) if on_start is not None else None
+    try:
+        while True:
+            for watcher, change in manager.watch():
+                if change.did_change:
+                    sink.send(watcher.name, change)
+            if forward_metrics:
+                snapshot = metrics.drain()
+                if snapshot is not None:
+                    sink.send_metrics(snapshot)
+            delay = min(manager.seconds_until_next_watch(), poll_interval)
+            if control is None:
+                threading.Event().wait(delay)
+                continue
+            try:
+                command, argument = control.get(timeout=delay)
+            except queue.Empty:
+                continue
+            if command == 'stop':
+                return
+            if command == 'set':
+                # Only touch the watchers that moved or changed, the rest keep their baselines and connections
+                manager.apply_watchers(argument)
+                logging.info(f'Shard worker {node_id} now has {len(manager.watchers)} watchers')
+    finally:
+        if started is not None:
+            started.close()
+        manager.close()
+
+
+class ShardedWatcherManager:
+    """ Run the watchers in shards and collect their changes, with the same interface as WatcherManager """
+    def __init__(self, watchers: list, fetch_config: dict=None, state_config: dict=None,
+                 schedule_config: dict=None, tick_frequency: int=60, sharding_config: dict=None):
+        """Start the shard workers, or listen for remote ones
+
+        Args:
+            watchers (list): The watcher items from the config file
+            fetch_config (dict, optional): The 'fetch_config' section of config.json. Defaults to None.
+            state_config (dict, optional): The 'state_config' section of config.json. Defaults to None.
+            schedule_config (dict, optional): The 'schedule_config' section of config.json. Defaults to None.
+            tick_frequency (int, optional): Interval for watchers that don't set their own. Defaults to 60.
+            sharding_config (dict, optional): The 'sharding_config' section of config.json. Defaults to None.
+        """
+        sharding_config = sharding_config or dict()
+        self.watchers_list = unique_watcher_items(watchers)
+        # The notifier only needs the watchers to look up the ones the events are about
+        self.watchers = read_watchers_from_config(watchers)
+        self.by_name = {watcher.name: watcher for watcher in self.watchers}
+        self.manager_args = (fetch_config, state_config, schedule_config, tick_frequency)
+        self.poll_interval = sharding_config.get('poll_interval', 1)
+        self.ring = HashRing(replicas=sharding_config.get('replicas', 100))
+        self.workers = dict()
+        self.next_worker = 0
+        self.source = None
+        if not sharding_config.get('listen') and state_config and state_config.get('backend', 'sqlite') != 'sqlite':
+            # Every local worker opens the state file, which only SQLite allows more than one process to do
+            raise InvalidStateStoreConfiguration('Local shard workers share the state file, use the sqlite backend')
+        if sharding_config.get('listen'):
+            # The workers run on other nodes and report to us
+            self.events = queue.Queue()
+            self.source = SocketEventSource(sharding_config['listen'], self.events)
+        else:
+            self.events = multiprocessing.Queue()
+            for _ in range(sharding_config.get('workers', multiprocessing.cpu_count())):
+                self.add_worker()
+
+
+    def add_worker(self):
+        """Start another local worker and move its share of the watchers to it
+
+        Returns:
+            str: The new worker's id
+        """
+        node_id = f'worker-{self.next_worker}'
+        self.next_worker += 1
+        self.ring.add(node_id)
+        shards = self.ring.assign(self.watchers_list)
+        control = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=run_shard_worker,
+            args=(
+                node_id, shards[node_id], QueueEventSink(self.events), self.manager_args, control,
+                self.poll_interval, metrics.enabled
+            ),
+            name=node_id,
+            daemon=True
+        )
+        process.start()
+        self.workers[node_id] = (process, control)
+        self.rebalance(shards, skip=node_id)
+        return node_id
+
+
+    def remove_worker(self, node_id: str):
+        """Stop a local worker and hand its watchers to the others
+
+        Args:
+            node_id (str): The worker's id
+        """
+        process, control = self.workers.pop(node_id)
+        control.put(('stop', None))
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+        self.ring.remove(node_id)
+        self.rebalance(self.ring.assign(self.watchers_list))
+
+
+    def rebalance(self, shards: dict, skip: str=None):
+        """Send every worker its current shard
+
+        Args:
+            shards (dict): The watcher items of every worker
+            skip (str, optional): A worker that already has its shard. Defaults to None.
+        """
+        for node_id, (_, control) in self.workers.items():
+            if node_id != skip:
+                control.put(('set', shards.get(node_id, [])))
+
+
+    def apply_watchers(self, watchers: list):
+        """Change the watched watchers, sending every local worker its new shard
+
+        Args:
+            watchers (list): The complete list of watcher items, as in the config file
+        """
+        if self.source is not None:
+            logging.warning('The watchers of remote shard workers are changed by their own config files')
+        self.watchers_list = unique_watcher_items(watchers)
+        self.watchers = read_watchers_from_config(watchers)
+        self.by_name = {watcher.name: watcher for watcher in self.watchers}
+        # A notifier that listens (or was given no workers) has no local workers to send shards to
+        if self.workers:
+            self.rebalance(self.ring.assign(self.watchers_list))
+
+
+    def watch(self):
+        """Yield the changes the workers found since the last call, and merge the metrics they sent
+
+        Yields:
+            tuple: The Watcher and a ChangeEvent with information about it
+        """
+        while True:
+            try:
+                kind, watcher_name, fields = self.events.get_nowait()
+            except queue.Empty:
+                metrics.maybe_log_summary()
+                return
+            if kind == 'metrics':
+                metrics.merge(fields)
+                continue
+            watcher = self.by_name.get(watcher_name)
+            if watcher is None:
+                logging.warning(f'Got a change for an unknown watcher {watcher_name}')
+                continue
+            yield watcher, ChangeEvent.from_dict(fields)
+
+
+    def seconds_until_next_watch(self):
+        """Get how long to wait before collecting the changes again
+
+        Returns:
+            float: The poll interval
+        """
+        return self.poll_interval
+
+
+    def close(self):
+        """ Stop the workers """
+        for node_id in list(self.workers.keys()):
+            process, control = self.workers.pop(node_id)
+            control.put(('stop', None))
+            process.join(timeout=10)
+        if self.source is not None:
+            self.source.close()
@@ -0,0 +1,275 @@
+"""
+Define the SnapshotStore class, keeping compressed past versions of the pages by their hash
+"""
+import os
+import json
+import mmap
+import time
+import zlib
+import hashlib
+import logging
+import threading
+
+# Marks the start of the two kinds of stored object
+FULL_OBJECT: bytes = b'F'
+DELTA_OBJECT: bytes = b'D'
+
+def split_lines(text: str):
+    """Split a page into the lines deltas are made of
+
+    Args:
+        text (str): The page
+
+    Returns:
+        list: The lines, keeping their line endings so joining them gives the page back
+    """
+    return text.splitlines(keepends=True)
+
+
+def make_delta(base: list, lines: list):
+    """Describe the new lines as runs copied from the base and literal lines, in linear time
+
+    Args:
+        base (list): The lines of the previous version
+        lines (list): The lines of the new version
+
+    Returns:
+        list: [start, end] for a run of base lines, or a string of lines that are not in the base
+    """
+    first_index = dict()
+    for index, line in enumerate(base):
+        first_index.setdefault(line, index)
+    operations = []
+    position = None
+    for line in lines:
+        # Most pages change in a few places, so the next line usually continues the current run
+        if position is not None and position < len(base) and base[position] == line:
+            operations[-1][1] += 1
+            position += 1
+        elif line in first_index:
+            position = first_index[line] + 1
+            operations.append([position - 1, position])
+        else:
+            position = None
+            if operations and isinstance(operations[-1], str):
+                operations[-1] += line
+            else:
+                operations.append(line)
+    return operations
+
+
+def apply_delta(base: list, operations: list):
+    """Rebuild a version from its base and the delta returned by make_delta()
+
+    Args:
+        base (list): The lines of the base version
+        operations (list): The delta
+
+    Returns:
+        str: The version's text
+    """
+    parts = []
+    for operation in operations:
+        if isinstance(operation, str):
+            parts.append(operation)
+        else:
+            parts.extend(base[operation[0]:operation[1]])
+    return ''.join(parts)
+
+
+class SnapshotStore:
+    """ Keep the last versions of every watcher's page, compressed and deduplicated by their hash """
+    def __init__(self, path: str, retention: int=20, keyframe_interval: int=10, level: int=6):
+        """Open (or create) the store's directory
+
+        Args:
+            path (str): The directory to keep the snapshots in
+            retention (int, optional): Versions kept per watcher, unless the watcher sets SnapshotRetention. Defaults to 20.
+            keyframe_interval (int, optional): Longest chain of deltas before a version is stored in full. Defaults to 10.
+            level (int, optional): The zlib compression level. Defaults to 6.
+        """
+        self.path = path
+        self.retention = retention
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        # Watchers are checked on several threads, and may share a page
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+
+    @classmethod
+    def from_config(cls, snapshot_config: dict):
+        """Create the store described by the 'snapshots' key of the 'state_config' section
+
+        Args:
+            snapshot_config (dict): The snapshot configuration
+
+        Returns:
+            SnapshotStore: The store, or None if snapshots are not configured or disabled
+        """
+        if not snapshot_config or not snapshot_config.get('enabled', True):
+            return None
+        path = snapshot_config.get('path', 'snapshots')
+        logging.info(f'Keeping page snapshots in {path}')
+        return cls(
+            path,
+            retention=snapshot_config.get('retention', 20),
+            keyframe_interval=snapshot_config.get('keyframe_interval', 10),
+            level=snapshot_config.get('level', 6)
+        )
+
+
+    def watcher_path(self, watcher_name: str):
+        """Get the directory of a watcher's snapshots
+
+        Args:
+            watcher_name (str): The watcher's name
+
+        Returns:
+            str: The directory, named by a hash of the watcher's name so any name is a valid path
+        """
+        return os.path.join(self.path, hashlib.blake2b(watcher_name.encode('utf-8'), digest_size=8).hexdigest())
+
+
+    def read_index(self, watcher_name: str):
+        """Read the versions kept for a watcher
+
+        Args:
+            watcher_name (str): The watcher's name
+
+        Returns:
+            list: [digest, timestamp] of every version, oldest first
+        """
+        try:
+            with open(os.path.join(self.watcher_path(watcher_name), 'index.json'), 'r') as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            return []
+
+
+    def write_file(self, path: str, data: bytes):
+        """ Write a file atomically, so a crash never leaves half an object or index """
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'wb') as output_file:
+            output_file.write(data)
+        os.replace(temporary_path, path)
+
+
+    def read_object(self, watcher_name: str, digest: str, with_payload: bool=True):
+        """Read a stored object through a memory map, without copying the file into memory first
+
+        Args:
+            watcher_name (str): The watcher's name
+            digest (str): The version's hash
+            with_payload (bool, optional): False to only read the header. Defaults to True.
+
+        Returns:
+            tuple: The kind, the base digest (or None), the chain depth and the uncompressed payload (or None)
+        """
+        with open(os.path.join(self.watcher_path(watcher_name), digest), 'rb') as object_file, \
+                mmap.mmap(object_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            header_end = mapped.find(b'\n')
+            kind, base, depth = bytes(mapped[:header_end]).decode('ascii').split(' ')
+            payload = None
+            if with_payload:
+                with memoryview(mapped) as view:
+                    payload = zlib.decompress(view[header_end + 1:])
+        return kind.encode('ascii'), (base if base != '-' else None), int(depth), payload
+
+
+    def load(self, watcher_name: str, digest: str):
+        """Get the text of a stored version
+
+        Args:
+            watcher_name (str): The watcher's name
+            digest (str): The version's hash
+
+        Returns:
+            str: The version's text, or None if it is not stored
+        """
+        with self.lock:
+            try:
+                return self.resolve(watcher_name, digest)
+            except FileNotFoundError:
+                return None
+
+
+    def resolve(self, watcher_name: str, digest: str):
+        """ Rebuild a version by following its chain of deltas, must be called with the lock held """
+        kind, base, _, payload = self.read_object(watcher_name, digest)
+        if kind == FULL_OBJECT:
+            return payload.decode('utf-8')
+        return apply_delta(split_lines(self.resolve(watcher_name, base)), json.loads(payload))
+
+
+    def save(self, watcher_name: str, digest: str, text: str, retention: int=None):
+        """Store a new version of a watcher's page, as a delta against the previous one when possible
+
+        Args:
+            watcher_name (str): The watcher's name
+            digest (str): The version's hash
+            text (str): The version's text
+            retention (int, optional): Versions to keep for this watcher. Defaults to None (the store's retention).
+        """
+        retention = self.retention if retention is None else retention
+        if retention <= 0:
+            return
+        directory = self.watcher_path(watcher_name)
+        with self.lock:
+            os.makedirs(directory, exist_ok=True)
+            index = self.read_index(watcher_name)
+            # A page that went back to a version we still have only needs a new index entry
+            if not os.path.exists(os.path.join(directory, digest)):
+                self.write_file(os.path.join(directory, digest), self.encode(watcher_name, index, text))
+            index.append([digest, time.time()])
+            index = index[-retention:]
+            self.write_file(os.path.join(directory, 'index.json'), json.dumps(index).encode('utf-8'))
+            self.prune(watcher_name, index)
+
+
+    def encode(self, watcher_name: str, index: list, text: str):
+        """ Build the stored object for a version, must be called with the lock held """
+        if index:
+            base = index[-1][0]
+            try:
+                _, _, depth, _ = self.read_object(watcher_name, base, with_payload=False)
+                if depth + 1 < self.keyframe_interval:
+                    operations = make_delta(split_lines(self.resolve(watcher_name, base)), split_lines(text))
+                    payload = json.dumps(operations, separators=(',', ':')).encode('utf-8')
+                    # A delta of a page that mostly changed is no smaller than the page itself
+                    if len(payload) < len(text):
+                        header = DELTA_OBJECT + f' {base} {depth + 1}\n'.encode('ascii')
+                        return header + zlib.compress(payload, self.level)
+            except FileNotFoundError:
+                pass
+        return FULL_OBJECT + b' - 0\n' + zlib.compress(text.encode('utf-8'), self.level)
+
+
+    def prune(self, watcher_name: str, index: list):
+        """ Delete the objects no kept version needs any more, must be called with the lock held """
+        directory = self.watcher_path(watcher_name)
+        needed = set()
+        for digest, _ in index:
+            # Keep the bases the kept deltas are built on
+            while digest is not None and digest not in needed:
+                needed.add(digest)
+                try:
+                    _, digest, _, _ = self.read_object(watcher_name, digest, with_payload=False)
+                except FileNotFoundError:
+                    break
+        for file_name in os.listdir(directory):
+            if file_name != 'index.json' and file_name not in needed:
+                os.remove(os.path.join(directory, file_name))
+
+
+    def history(self, watcher_name: str):
+        """Get the versions kept for a watcher
+
+        Args:
+            watcher_name (str): The watcher's name
+
+        Returns:
+            list: (digest, timestamp) of every version, oldest first
+        """
+        with self.lock:
+            return [tuple(entry) for entry in self.read_index(watcher_name)]
@@ -0,0 +1,135 @@
+"""
+Define the state stores used to keep the watchers' baselines across restarts
+"""
+import abc
+import json
+import logging
+import threading
+
+class InvalidStateStoreConfiguration(Exception):
+    """ Indicate that the 'state_config' section is invalid """
+    pass
+
+class StateStore(abc.ABC):
+    """ Base class for the state backends, keeping a JSON document per watcher name """
+    @abc.abstractmethod
+    def load(self):
+        """Read the state of every watcher
+
+        Returns:
+            dict: The saved states, by watcher name
+        """
+
+
+    @abc.abstractmethod
+    def save(self, states: dict):
+        """Write the given states in a single batch
+
+        Args:
+            states (dict): The states to write, by watcher name
+        """
+
+
+    def close(self):
+        """ Release the backend """
+        pass
+
+
+class SqliteStateStore(StateStore):
+    """ Keep the states in an embedded SQLite database """
+    def __init__(self, path: str):
+        """Open (or create) the database
+
+        Args:
+            path (str): The database file
+        """
+        import sqlite3
+        # Ticks may run on different threads, the lock makes sure only one uses the connection at a time
+        self.lock = threading.Lock()
+        # Local shard workers share the file, wait for each other's writes instead of failing
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Readers don't block the writer (and the other way around) with a write-ahead log
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS watcher_state (name TEXT PRIMARY KEY, state TEXT NOT NULL)'
+            )
+
+
+    def load(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT name, state FROM watcher_state').fetchall()
+        return {name: json.loads(state) for name, state in rows}
+
+
+    def save(self, states: dict):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO watcher_state (name, state) VALUES (?, ?)',
+                [(name, json.dumps(state)) for name, state in states.items()]
+            )
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class DbmStateStore(StateStore):
+    """ Keep the states in a dbm key-value file """
+    def __init__(self, path: str):
+        """Open (or create) the dbm file
+
+        Args:
+            path (str): The dbm file
+        """
+        import dbm
+        self.lock = threading.Lock()
+        self.db = dbm.open(path, 'c')
+
+
+    def load(self):
+        with self.lock:
+            return {key.decode('utf-8'): json.loads(self.db[key]) for key in self.db.keys()}
+
+
+    def save(self, states: dict):
+        with self.lock:
+            for name, state in states.items():
+                self.db[name.encode('utf-8')] = json.dumps(state)
+            # Not every dbm flavour can sync, the ones that can't write through on every assignment
+            if hasattr(self.db, 'sync'):
+                self.db.sync()
+
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# The available backends, by the name used in config.json
+STATE_BACKENDS = {
+    'sqlite': SqliteStateStore,
+    'dbm': DbmStateStore
+}
+
+def create_state_store(state_config: dict):
+    """Create the state store described by the 'state_config' section of config.json
+
+    Args:
+        state_config (dict): The state configuration
+
+    Raises:
+        InvalidStateStoreConfiguration: If the backend is unknown
+
+    Returns:
+        StateStore: The state store, or None if persistence is not configured
+    """
+    if not state_config:
+        return None
+    backend = state_config.get('backend', 'sqlite')
+    if backend not in STATE_BACKENDS:
+        raise InvalidStateStoreConfiguration(f'Unknown state backend {backend}!')
+    path = state_config.get('path', 'watcher_state.db')
+    logging.info(f'Keeping the watchers state in {path} ({backend})')
+    return STATE_BACKENDS[backend](path)
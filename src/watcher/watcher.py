@@ -1,7 +1,17 @@
 """
 Define the Watcher class
 """
-import requests
+import re
+import sys
+import json
+import time
+from urllib.parse import urlsplit
+from watcher.body_scanner import BodyScanner
+from watcher.circuit_breaker import HostUnavailable, parse_retry_after
+from watcher.http_session import HttpSession
+from watcher.metrics import metrics
+from watcher.normalizer import shared_normalizer
+from watcher.pattern_matcher import shared_matcher
 
 class InvalidWatcherConfiguration(Exception):
     """ Indicate that the configuration given to the watcher is invalid """
@@ -9,6 +19,12 @@ class InvalidWatcherConfiguration(Exception):
 
 class Watcher:
     """ Hold information about a watcher """
+    # Slots instead of a __dict__, deployments can have a hundred thousand watchers
+    __slots__ = (
+        'name', 'url', 'host', 'alert_any_change', 'use_regex', 'interval', 'diff', 'snapshot_retention',
+        'snapshot', 'digest', 'matches', 'etag', 'last_modified', 'last_check', 'matcher', 'normalize_json', 'normalizer'
+    )
+
     def __init__(self, watcher_item: dict):
         """Initiate a watcher object from the config file.
 
@@ -21,41 +37,173 @@ class Watcher:
         try:
             self.name = watcher_item['Name'] 
             self.url = watcher_item['URL']
-            self.whitelist = watcher_item['Whitelist']
-            self.blacklist = watcher_item['Blacklist']
+            # Many watchers share a host, keep a single copy of it
+            self.host = sys.intern(urlsplit(self.url).netloc)
+            whitelist = watcher_item['Whitelist']
+            blacklist = watcher_item['Blacklist']
             self.alert_any_change = watcher_item['AlertAnyChange']
-            self.md5 = None
-            self.previous_whitelisted = []
-            self.previous_blacklisted = []
+            self.use_regex = watcher_item.get('UseRegex', False)
+            # Seconds between checks, None to use the mode's tick_frequency
+            self.interval = watcher_item.get('Interval')
+            # Keep the last normalized page, to report what changed in it
+            self.diff = watcher_item.get('Diff', False)
+            # Versions to keep in the snapshot store, None to use its retention
+            self.snapshot_retention = watcher_item.get('SnapshotRetention')
+            self.snapshot = None
+            # The page's digest bytes and the bitset of the patterns found in it, as of the last change
+            self.digest = None
+            self.matches = 0
+            # Validators sent by the server, used to make conditional requests
+            self.etag = None
+            self.last_modified = None
+            self.last_check = None
         except KeyError as exception:
             invalid_key = exception.args[0]
             raise InvalidWatcherConfiguration(
                 f'Invalid configuration! Key {invalid_key} was not supplied!'
-            )    
+            )
+
+        # Compile the lists and the normalization once (and only once for all the watchers with the same ones),
+        # so every check is a single scan of the page
+        try:
+            self.matcher = shared_matcher(whitelist, blacklist, self.use_regex)
+            normalize_item = watcher_item.get('Normalize')
+            self.normalize_json = json.dumps(normalize_item, sort_keys=True) if normalize_item is not None else None
+            self.normalizer = shared_normalizer(self.normalize_json) if normalize_item is not None else None
+        except re.error as exception:
+            raise InvalidWatcherConfiguration(
+                f'Invalid configuration! Bad pattern for {self.name}: {exception}'
+            )
+
+
+    @property
+    def whitelist(self):
+        """ The whitelisted patterns, from the shared matcher """
+        return self.matcher.whitelist
+
+
+    @property
+    def blacklist(self):
+        """ The blacklisted patterns, from the shared matcher """
+        return self.matcher.blacklist
+
+
+    def conditional_headers(self):
+        """Build the headers that let the server skip sending an unchanged page
+
+        Returns:
+            dict: The If-None-Match / If-Modified-Since headers for the next request
+        """
+        headers = dict()
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
 
 
-    def get_html(self):
-        """Get the current HTML from the web
+    def to_state(self):
+        """Get the state that should survive a restart
 
         Returns:
-            str: The HTML retrived from the given URL
-        """      
-        return requests.get(self.url).text
+            dict: The watcher's baseline, validators and last check time
+        """
+        # Saved as words rather than bits, so the state still means the same after the lists are edited
+        whitelisted, blacklisted = self.matcher.split_bits(self.matches)
+        return {
+            'url': self.url,
+            'digest': self.digest.hex() if self.digest is not None else None,
+            'whitelisted': whitelisted,
+            'blacklisted': blacklisted,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'last_check': self.last_check
+        }
+
 
-    
-    def set_hash(self, new_hash: str):
-        """Set the last known hash to a new value
+    def restore_state(self, state: dict):
+        """Continue from a state saved before a restart
 
         Args:
-            new_hash (str): the updated hash
+            state (dict): A state returned by to_state()
         """
-        self.md5 = new_hash
+        # The saved baseline is meaningless if the watcher now points somewhere else
+        if state.get('url') != self.url:
+            return
+        # States saved before the switch to BLAKE2b only have an MD5, so their first check sets a new baseline
+        self.digest = bytes.fromhex(state['digest']) if state.get('digest') else None
+        self.matches = self.matcher.bits_of(state.get('whitelisted', []), state.get('blacklisted', []))
+        self.etag = state.get('etag')
+        self.last_modified = state.get('last_modified')
+        self.last_check = state.get('last_check')
 
 
-    def __hash__(self):
-        """Get the last known hash of the site's HTML
+    def evaluation_spec(self):
+        """Describe how to evaluate this watcher's pages, for a worker process to compile
 
         Returns:
-            str: The last calculated hash
-        """        
-        return self.md5
\ No newline at end of file
+            tuple: The whitelist, blacklist, regex flag and normalization (as JSON)
+        """
+        return (self.matcher.whitelist, self.matcher.blacklist, self.use_regex, self.normalize_json)
+
+
+    def read_page(self, http: HttpSession, chunk_size: int=65536, max_body_size: int=None, evaluation_pool=None,
+                  capture: bool=False):
+        """Stream the current page from the web, hashing and matching it as it arrives
+
+        Args:
+            http (HttpSession): The shared session to send the request with
+            chunk_size (int, optional): How many bytes to read at a time. Defaults to 65536.
+            max_body_size (int, optional): Stop reading after this many bytes. Defaults to None (no limit).
+            evaluation_pool (EvaluationPool, optional): Where to evaluate large pages. Defaults to None (in-process).
+            capture (bool, optional): Keep what it takes to get the text of a changed page, to snapshot it. Defaults to False.
+
+        Raises:
+            HostUnavailable: If the server answered 429 Too Many Requests or a server error
+
+        Returns:
+            PageScan: The page's hash with its hits or normalized text and the response's validators,
+                or None if the server answered 304 Not Modified
+        """
+        start = metrics.start()
+        with http.get(self.url, headers=self.conditional_headers(), stream=True) as response:
+            # Until the headers arrive - DNS, connecting, TLS and the server's think time
+            metrics.observe_phase('connect', self.name, start)
+            if response.status_code == 304:
+                metrics.increment('websitewatcher_not_modified_total')
+                return None
+            # An error page is not a change of the page, and a throttling server should be left alone for a while
+            if response.status_code == 429 or response.status_code >= 500:
+                raise HostUnavailable(
+                    f'{self.host} answered {response.status_code}',
+                    parse_retry_after(response.headers.get('Retry-After'))
+                )
+            # Large pages are hashed and matched in a worker process, unless their text is needed here
+            if evaluation_pool is not None and not self.diff and \
+                    evaluation_pool.should_offload(response.headers.get('Content-Length')):
+                start = metrics.start()
+                page, size = evaluation_pool.evaluate(response, self, chunk_size, max_body_size, capture)
+                metrics.observe_phase('offload', self.name, start)
+                metrics.increment('websitewatcher_offloaded_total')
+                metrics.increment('websitewatcher_bytes_fetched_total', size)
+                page.etag, page.last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+                return page
+            scanner = BodyScanner(
+                self.matcher, response.encoding, max_body_size, normalizer=self.normalizer, keep_text=self.diff,
+                capture=capture
+            )
+            start = metrics.start()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not scanner.feed(chunk):
+                    break
+            page = scanner.finish()
+            page.etag, page.last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if scanner.timings is not None and start is not None:
+            # The rest of the time reading the body was spent waiting for it
+            processing = sum(scanner.timings.values())
+            metrics.observe_phase('download', self.name, duration=max(time.perf_counter() - start - processing, 0))
+            for phase, duration in scanner.timings.items():
+                if duration > 0:
+                    metrics.observe_phase(phase, self.name, duration=duration)
+        metrics.increment('websitewatcher_bytes_fetched_total', scanner.size)
+        return page
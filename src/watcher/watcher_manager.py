@@ -1,22 +1,158 @@
 """
 Define the WatcherManager class
 """
+import time
 import logging
+import threading
+import requests
 from watcher.watcher import Watcher
+from watcher.fetch_pool import FetchPool
+from watcher.circuit_breaker import CircuitBreaker, HostUnavailable
+from watcher.evaluation_pool import EvaluationPool
+from watcher.http_session import HttpSession
 from watcher.change_event import ChangeEvent
-from watcher.watcher_utils import calculate_md5, search_wordlist, read_watchers_from_config
+from watcher.diff_engine import diff_text
+from watcher.state_store import create_state_store
+from watcher.snapshot_store import SnapshotStore
+from watcher.scheduler import WatchScheduler
+from watcher.metrics import metrics
+from watcher.watcher_utils import read_watchers_from_config, unique_watcher_items
 
 class WatcherManager:
     """ Manage watchers """
-    def __init__(self, watchers: list):
+    def __init__(self, watchers: list, fetch_config: dict=None, state_config: dict=None,
+                 schedule_config: dict=None, tick_frequency: int=60):
         """Initiate the manager
 
         Args:
             watchers (list): a list of Watcher objects
+            fetch_config (dict, optional): The 'fetch_config' section of config.json. Defaults to None.
+            state_config (dict, optional): The 'state_config' section of config.json. Defaults to None.
+            schedule_config (dict, optional): The 'schedule_config' section of config.json. Defaults to None.
+            tick_frequency (int, optional): Interval for watchers that don't set their own. Defaults to 60.
         """
+        fetch_config = fetch_config or dict()
+        # Watchers may be added or removed from other threads (config reloads, bot commands) while a tick runs
+        self.lock = threading.RLock()
+        watchers = unique_watcher_items(watchers)
         self.watchers = read_watchers_from_config(watchers)
+        # The config item each watcher was built from, to tell which ones a reload changed
+        self.watcher_items = {watcher_item.get('Name'): watcher_item for watcher_item in watchers}
+        self.scheduler = WatchScheduler.from_config(schedule_config or dict(), tick_frequency)
+        for watcher in self.watchers:
+            self.scheduler.add(watcher)
+        self.fetch_pool = FetchPool(
+            max_concurrency=fetch_config.get('max_concurrency', 8),
+            per_host_concurrency=fetch_config.get('per_host_concurrency', 2)
+        )
+        self.http = HttpSession.from_config(fetch_config)
+        self.breaker = CircuitBreaker.from_config(fetch_config)
+        self.chunk_size = fetch_config.get('chunk_size', 65536)
+        self.max_body_size = fetch_config.get('max_body_size', None)
+        # None unless evaluation_workers is set, then large pages are evaluated in worker processes
+        self.evaluation_pool = EvaluationPool.from_config(fetch_config)
+        # The state store is opened on the first watch, so startup doesn't wait for it
+        self.state_config = state_config
+        self.state_store = None
+        self.state_loaded = False
+        # Past versions of the pages, None unless state_config has a 'snapshots' key
+        self.snapshots = SnapshotStore.from_config((state_config or dict()).get('snapshots'))
 
     
+    def load_state(self):
+        """ Open the state store and restore the watchers from it """
+        self.state_loaded = True
+        self.state_store = create_state_store(self.state_config)
+        if self.state_store is None:
+            return
+        states = self.state_store.load()
+        for watcher in self.watchers:
+            if watcher.name in states:
+                watcher.restore_state(states[watcher.name])
+        logging.info(f'Restored the state of {len(states)} watchers')
+
+
+    def save_state(self, watchers: list):
+        """Write the state of the given watchers in one batch
+
+        Args:
+            watchers (list): The watchers checked in this tick
+        """
+        if self.state_store is None or len(watchers) == 0:
+            return
+        self.state_store.save({watcher.name: watcher.to_state() for watcher in watchers})
+
+
+    def add_watchers(self, watchers: list):
+        """Start watching more watchers, continuing from their saved state if they have one
+
+        Args:
+            watchers (list): Watcher items, as in the config file
+
+        Returns:
+            list: The Watcher objects created
+        """
+        new_watchers = read_watchers_from_config(watchers)
+        if self.state_store is not None and len(new_watchers) > 0:
+            states = self.state_store.load()
+            for watcher in new_watchers:
+                if watcher.name in states:
+                    watcher.restore_state(states[watcher.name])
+        with self.lock:
+            for watcher_item in watchers:
+                self.watcher_items[watcher_item.get('Name')] = watcher_item
+            for watcher in new_watchers:
+                self.watchers.append(watcher)
+                self.scheduler.add(watcher)
+        return new_watchers
+
+
+    def remove_watchers(self, names: set):
+        """Stop watching some watchers
+
+        Args:
+            names (set): The names of the watchers to remove
+
+        Returns:
+            list: The Watcher objects removed
+        """
+        with self.lock:
+            removed = [watcher for watcher in self.watchers if watcher.name in names]
+            self.watchers = [watcher for watcher in self.watchers if watcher.name not in names]
+            for watcher in removed:
+                self.scheduler.remove(watcher)
+                self.watcher_items.pop(watcher.name, None)
+        return removed
+
+
+    def apply_watchers(self, watchers: list):
+        """Change the watched watchers to the given ones, touching only those that were added, removed or changed
+
+        Args:
+            watchers (list): The complete list of watcher items, as in the config file
+
+        Returns:
+            tuple: The names of the added, removed and changed watchers
+        """
+        wanted = {watcher_item.get('Name'): watcher_item for watcher_item in unique_watcher_items(watchers)}
+        with self.lock:
+            current = dict(self.watcher_items)
+            old_watchers = {watcher.name: watcher for watcher in self.watchers}
+            added = [name for name in wanted if name not in current]
+            removed = [name for name in current if name not in wanted]
+            changed = [name for name in wanted if name in current and wanted[name] != current[name]]
+            self.remove_watchers(set(removed) | set(changed))
+            rebuilt = self.add_watchers([wanted[name] for name in changed])
+            # A changed watcher keeps its baseline if it still watches the same URL
+            for watcher in rebuilt:
+                if watcher.name in old_watchers:
+                    watcher.restore_state(old_watchers[watcher.name].to_state())
+            self.add_watchers([wanted[name] for name in added])
+        if added or removed or changed:
+            logging.info(f'Applied the watchers: {len(added)} added, {len(removed)} removed, {len(changed)} changed')
+        return added, removed, changed
+
+
     def run_watcher(self, watcher: Watcher):
         """Run a watcher and create a ChangeEvent with information about whether the site changed
 
@@ -28,38 +164,162 @@ class WatcherManager:
         """
         logging.info(f'Now Running Watcher for {watcher.name}')
         change = ChangeEvent()
-        # Grab the HTML and calculate the MD5 for it
-        new_html = watcher.get_html()
-        new_md5 = calculate_md5(new_html)
+        watcher.last_check = time.time()
+        metrics.increment('websitewatcher_checks_total')
+        # Stream the page, hashing it (and unless it is normalized, looking for the white/black-listed words) as it arrives
+        keep_snapshots = self.snapshots is not None and watcher.snapshot_retention != 0
+        try:
+            page = watcher.read_page(
+                self.http, self.chunk_size, self.max_body_size, self.evaluation_pool, capture=keep_snapshots
+            )
+            # The server told us the page is the same as last time, nothing to check
+            if page is None:
+                logging.debug(f'{watcher.name} was not modified')
+                return change
+        except Exception:
+            metrics.increment('websitewatcher_errors_total')
+            raise
+        new_digest = page.digest
+        # Normalized pages are only matched when their hash shows a real change
+        if page.hits is None and page.matches is None and new_digest == watcher.digest:
+            self.commit_validators(watcher, page)
+            return change
+        if page.matches is not None:
+            # A worker process already matched the page
+            matches = page.matches
+        else:
+            if page.hits is None:
+                start = metrics.start()
+                page.hits = watcher.matcher.first_hits(page.text)
+                metrics.observe_phase('match', watcher.name, start)
+            matches = watcher.matcher.match_bits(page.hits)
+        # Only versions we haven't seen last time are stored, so unchanged ticks cost no disk
+        if keep_snapshots and new_digest != watcher.digest:
+            start = metrics.start()
+            # Unless the text was kept, it is only decompressed now that the page turned out to have changed
+            text = page.captured_text()
+            if text is not None:
+                self.snapshots.save(watcher.name, new_digest.hex(), text, watcher.snapshot_retention)
+            metrics.observe_phase('snapshot', watcher.name, start)
 
-        # Make sure that if it's the first run we don't alert a change
-        if watcher.md5 is None:
-            watcher.md5 = new_md5
+        # Make sure that if it's the first run we don't alert a change, but remember the words already there
+        if watcher.digest is None:
+            watcher.digest = new_digest
+            watcher.matches = matches
+            watcher.snapshot = page.text if watcher.diff and not keep_snapshots else None
 
         # If the page was changed since the last check
-        if new_md5 != watcher.md5:
-            logging.debug(f'Found new MD5! {new_md5}')
-            # Get the white/black-listed words from the HTML
-            whitelisted = search_wordlist(watcher.whitelist, new_html)
-            blacklisted = search_wordlist(watcher.blacklist, new_html)
-            
-            # Set the ChangeEvent values
+        if new_digest != watcher.digest:
+            logging.debug(f'Found new digest! {new_digest.hex()}')
+            metrics.increment('websitewatcher_changes_total')
+            # Set the ChangeEvent values, the added and removed patterns are just the bits that flipped
             change.did_change = True
-            change.new_whitelisted = [word for word in whitelisted if word not in watcher.previous_whitelisted]
-            change.new_blacklisted = [word for word in blacklisted if word not in watcher.previous_blacklisted]
-            
+            change.new_whitelisted, change.new_blacklisted = watcher.matcher.split_bits(matches & ~watcher.matches)
+            change.removed_whitelisted, change.removed_blacklisted = watcher.matcher.split_bits(watcher.matches & ~matches)
+            if watcher.diff and page.text is not None:
+                # With a snapshot store the previous version is read from it, also after a restart
+                previous = self.snapshots.load(watcher.name, watcher.digest.hex()) if keep_snapshots else watcher.snapshot
+                if previous is not None:
+                    change.text_diff = diff_text(previous, page.text)
+
             # Set the watcher values
-            watcher.md5 = new_md5
-            watcher.previous_whitelisted = whitelisted
-            watcher.previous_blacklisted = blacklisted
+            watcher.digest = new_digest
+            watcher.matches = matches
+            watcher.snapshot = page.text if watcher.diff and not keep_snapshots else None
+        self.commit_validators(watcher, page)
         return change
 
+
+    def commit_validators(self, watcher: Watcher, page):
+        """Save the response's validators on the watcher, once its digest is up to date with the page
+
+        A conditional request with the new validators gets a 304 for this version of the page,
+        so saving them before the change was recorded would lose the change if recording it failed.
+
+        Args:
+            watcher (Watcher): The watcher that was checked
+            page (PageScan): The page it read
+        """
+        watcher.etag = page.etag
+        watcher.last_modified = page.last_modified
+
+
+    def check_watcher(self, watcher: Watcher):
+        """Run a watcher unless its host's circuit is open, so one failing watcher never stops the others
+
+        Args:
+            watcher (Watcher): The watcher to check
+
+        Returns:
+            ChangeEvent: Information about whether the site changed, empty if it was skipped or failed
+        """
+        if not self.breaker.allow(watcher.host):
+            logging.debug(f'Skipping {watcher.name}, {watcher.host} is failing')
+            metrics.increment('websitewatcher_breaker_skipped_total')
+            return ChangeEvent(error=f'Skipped, {watcher.host} is failing')
+        try:
+            change = self.run_watcher(watcher)
+        except (requests.RequestException, HostUnavailable) as exception:
+            logging.error(f'Checking {watcher.name} failed: {exception}')
+            self.breaker.record_failure(watcher.host, getattr(exception, 'retry_after', None))
+            return ChangeEvent(error=str(exception))
+        except Exception as exception:
+            # A bug or a local error (state, snapshots, matching) says nothing about the host
+            logging.exception(f'Checking {watcher.name} failed')
+            self.breaker.release(watcher.host)
+            return ChangeEvent(error=str(exception))
+        self.breaker.record_success(watcher.host)
+        return change
+
+
     def watch(self):
-        """Iterate over the watchers and watch each one
+        """Watch the watchers that are due concurrently, yielding each one as soon as it is done
 
         Yields:
-            ChangeEvent: Information about a given watcher
+            tuple: The Watcher and a ChangeEvent with information about it
         """
         logging.debug('Running a watch iteration...')
-        for watcher in self.watchers:
-            yield watcher, self.run_watcher(watcher)
+        if not self.state_loaded:
+            self.load_state()
+        start = metrics.start()
+        with self.lock:
+            due = self.scheduler.pop_due()
+        checked = []
+        try:
+            for watcher, change in self.fetch_pool.run(due, self.check_watcher):
+                with self.lock:
+                    # A failed or skipped check tells nothing about how often the page changes
+                    self.scheduler.reschedule(watcher, change.did_change if change.error is None else None)
+                checked.append(watcher)
+                yield watcher, change
+        finally:
+            # Watchers that didn't finish still need a place in the schedule
+            finished = set(id(watcher) for watcher in checked)
+            with self.lock:
+                for watcher in due:
+                    if id(watcher) not in finished:
+                        self.scheduler.reschedule(watcher, None)
+            self.save_state(checked)
+            if start is not None:
+                metrics.observe('websitewatcher_tick_seconds', time.perf_counter() - start)
+            metrics.maybe_log_summary()
+
+
+    def seconds_until_next_watch(self):
+        """Get how long to wait before calling watch() again
+
+        Returns:
+            float: Seconds until the next watcher is due
+        """
+        with self.lock:
+            return self.scheduler.seconds_until_due()
+
+
+    def close(self):
+        """ Release the worker threads and processes and the pooled connections """
+        self.fetch_pool.close()
+        if self.evaluation_pool is not None:
+            self.evaluation_pool.close()
+        self.http.close()
+        if self.state_store is not None:
+            self.state_store.close()
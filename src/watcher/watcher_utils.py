@@ -2,9 +2,31 @@
 Utility functions used in the Watcher codebase
 """
 import logging
-import hashlib
 from watcher.watcher import Watcher, InvalidWatcherConfiguration
 
+def unique_watcher_items(watchers_list: list):
+    """Drop the watcher items whose name an earlier item already has
+
+    Watchers are scheduled, saved and reloaded by their name, so only one watcher can have each name.
+
+    Args:
+        watchers_list (list): List of watcher objects from the config file
+
+    Returns:
+        list: The items, keeping the first one of every name
+    """
+    names = set()
+    unique_items = []
+    for watcher_item in watchers_list:
+        name = watcher_item.get('Name')
+        if name in names:
+            logging.error(f'Duplicate watcher name ({name})! Only the first watcher with this name is watched')
+            continue
+        names.add(name)
+        unique_items.append(watcher_item)
+    return unique_items
+
+
 def read_watchers_from_config(watchers_list: list):
     """Parse the supplied json into a list of Watcher objects.
 
@@ -16,38 +38,14 @@ def read_watchers_from_config(watchers_list: list):
     """
     logging.debug('Creating Watcher objects...')
     watcher_objects = []
-    for watcher_item in watchers_list:
+    for watcher_item in unique_watcher_items(watchers_list):
         try:
             watcher_objects.append(
                 Watcher(watcher_item)
             )
         except InvalidWatcherConfiguration:
-            logging.error(f'Invalid Configuration ({watcher_item.name})!')
+            logging.error(f"Invalid Configuration ({watcher_item.get('Name')})!")
     number_of_watchers = len(watcher_objects)
     logging.info(f'Created {number_of_watchers} watchers')
     return watcher_objects
 
-
-def calculate_md5(html: str):
-    """Calculate the MD5 of the given HTML
-
-    Args:
-        html (str): The HTML to calculate MD5 for
-
-    Returns:
-        str: The MD5 of the given HTML string
-    """
-    return hashlib.md5(html.encode('utf-8'))
-
-
-def search_wordlist(words: list, html: str):
-    """Return the words in a list that appear in the HTML
-
-    Args:
-        words (list): A list of words to look for
-        html (str): The string to look for the words in
-
-    Returns:
-        list: The list of words from the list found in the HTML
-    """
-    return [word for word in words if word in html]
\ No newline at end of file
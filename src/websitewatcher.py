@@ -3,52 +3,162 @@ WebsiteWatcher.py - Watch websites for changes and alert the human about it!
 Author: OzTamir
 URL: https://github.com/OzTamir/WebsiteWatcher
 """
+import time
+# Measure from before the imports, to report how long startup takes
+STARTED = time.perf_counter()
+import sys
 import json
 import logging
+import argparse
 from configuration import Configuration
+from config_reloader import ConfigReloader
 from watcher.watcher_manager import WatcherManager
-from twilio_mode import TwilioWatcher
-from telegram_bot import Bot
+from watcher.metrics import metrics
+IMPORTED = time.perf_counter()
 
 logging.basicConfig(
     level=logging.INFO,
     format='[WebsiteWatcher][%(levelname)s][%(filename)s:%(funcName)s]: %(message)s')
 CONFIG_FILE = 'config.json'
 
-def telegram_mode(watcher: WatcherManager, config: Configuration):
+def report_startup(mode: str):
+    """Log how long it took to get a mode running
+
+    Args:
+        mode (str): The mode that is starting
+    """
+    logging.info(
+        f'Started {mode} mode in {time.perf_counter() - STARTED:.3f}s '
+        f'(the common imports took {IMPORTED - STARTED:.3f}s)'
+    )
+
+def telegram_mode(watcher: WatcherManager, config: Configuration, reloader: ConfigReloader):
     """Run the telegram bot
 
     Args:
         watcher (WatcherManager): A WatcherManager object, used to manage the watching of urls
         config (Configuration): A python representation of the config file on the disk
+        reloader (ConfigReloader): Applies changes to the watchers in the config file
     """
-    bot = Bot(watcher, config.token, config.password, config.tick_frequency)
+    from telegram_bot import Bot
+    bot = Bot(
+        watcher, config.token, config.password, config.tick_frequency,
+        config.per_chat_rate, config.global_rate, config.send_retries, reloader
+    )
+    report_startup(config.mode)
     bot.run_bot()
 
-def twilio_mode(watcher: WatcherManager, config: Configuration):
+def twilio_mode(watcher: WatcherManager, config: Configuration, reloader: ConfigReloader):
     """Run the Twilio loop
 
     Args:
         watcher (WatcherManager): A WatcherManager object, used to manage the watching of urls
         config (Configuration): A python representation of the config file on the disk
+        reloader (ConfigReloader): Applies changes to the watchers in the config file
     """
+    from twilio_mode import TwilioWatcher
     twilio_watcher = TwilioWatcher(watcher, config)
+    report_startup(config.mode)
     twilio_watcher.run_watcher()
 
-def main():
+# The mode backends, by Configuration.mode. Each one imports its SDK when it runs, so only the configured one is loaded
+MODES = {
+    Configuration.TELEGRAM: telegram_mode,
+    Configuration.TWILIO: twilio_mode
+}
+
+def shard_worker_mode(config: Configuration, config_path: str):
+    """Watch this node's shard and send the changes to the notifier node
+
+    Args:
+        config (Configuration): A python representation of the config file on the disk
+        config_path (str): The config file, reloaded to apply this node's shard of its watchers
+    """
+    from watcher.sharding import HashRing, NodeShard, SocketEventSink, run_shard_worker
+    sharding_config = config.sharding_config
+    node_id = sharding_config['node_id']
+    ring = HashRing(sharding_config['nodes'], sharding_config.get('replicas', 100))
+    shard = ring.assign(config.watchers_list).get(node_id, [])
+    manager_args = (config.fetch_config, config.state_config, config.schedule_config, config.tick_frequency)
+
+    def start_reloader(manager: WatcherManager):
+        return ConfigReloader(config_path, NodeShard(manager, ring, node_id), config.reload_interval)
+
+    run_shard_worker(node_id, shard, SocketEventSink(sharding_config['notifier']), manager_args, on_start=start_reloader)
+
+def check_once(config: Configuration):
+    """Check every watcher once, print the results as JSON lines and return an exit code
+
+    Args:
+        config (Configuration): A python representation of the config file on the disk
+
+    Returns:
+        int: 0 if nothing changed, 1 if a page changed, 2 if a check failed
+    """
+    # Without jitter every watcher is due right away
+    schedule_config = dict(config.schedule_config, jitter=0)
+    manager = WatcherManager(
+        config.watchers_list, config.fetch_config, config.state_config, schedule_config, config.tick_frequency
+    )
+    changed = failed = 0
+    try:
+        for watcher, change in manager.watch():
+            changed += change.did_change
+            failed += change.error is not None
+            print(json.dumps(dict(watcher=watcher.name, url=watcher.url, **change.to_dict()), ensure_ascii=False))
+    finally:
+        manager.close()
+    logging.info(
+        f'Checked {len(manager.watchers)} watchers in {time.perf_counter() - STARTED:.3f}s '
+        f'(the imports took {IMPORTED - STARTED:.3f}s): {changed} changed, {failed} failed'
+    )
+    if failed:
+        return 2
+    return 1 if changed else 0
+
+def parse_arguments(argv: list=None):
+    """Parse the command line
+
+    Args:
+        argv (list, optional): The arguments. Defaults to None (sys.argv).
+
+    Returns:
+        argparse.Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='Watch websites for changes and alert the human about it!')
+    parser.add_argument('--config', default=CONFIG_FILE, help='The configuration file')
+    parser.add_argument('--check-once', action='store_true',
+                        help='Check every watcher once, print the results and exit with 0 (no change), 1 (changed) or 2 (failed)')
+    return parser.parse_args(argv)
+
+def main(argv: list=None):
+    arguments = parse_arguments(argv)
     logging.info('Starting...')
     # Setup the configuration and the WatcherManager, both of which are the same in both modes
-    config = Configuration(CONFIG_FILE)
-    watcher_manager = WatcherManager(config.watchers_list)
-
-    # Run in the configured mode
-    if config.mode == Configuration.TELEGRAM:
-        return telegram_mode(watcher_manager, config)
-    elif config.mode == Configuration.TWILIO:
-        return twilio_mode(watcher_manager, config)
+    config = Configuration(arguments.config)
+    if arguments.check_once:
+        return check_once(config)
+    metrics.configure(config.metrics_config)
+    manager_args = (
+        config.watchers_list, config.fetch_config, config.state_config,
+        config.schedule_config, config.tick_frequency
+    )
+    if config.sharding_config is None:
+        watcher_manager = WatcherManager(*manager_args)
+    elif config.sharding_config.get('node_id') is not None:
+        # This node only watches its shard, the notifier node reports the changes
+        return shard_worker_mode(config, arguments.config)
     else:
+        from watcher.sharding import ShardedWatcherManager
+        watcher_manager = ShardedWatcherManager(*manager_args, config.sharding_config)
+
+    reloader = ConfigReloader(arguments.config, watcher_manager, config.reload_interval)
+
+    # Run in the configured mode, importing only its backend
+    if config.mode not in MODES:
         # This should never happen, as it is checked when the configuration is parsed that one mode is enabled
         raise NotImplementedError
+    return MODES[config.mode](watcher_manager, config, reloader)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
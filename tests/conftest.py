@@ -0,0 +1,51 @@
+"""
+Make the modules under src importable the same way websitewatcher.py imports them, and serve test pages
+"""
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+class PageHandler(BaseHTTPRequestHandler):
+    """ Serve the server's current page, answering 304 to a matching If-None-Match """
+    def do_GET(self):
+        page = self.server.page
+        self.server.requests.append(self.headers.get('If-None-Match'))
+        if page['status'] != 200:
+            self.send_response(page['status'])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if page['etag'] is not None and self.headers.get('If-None-Match') == page['etag']:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = page['body'].encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if page['etag'] is not None:
+            self.send_header('ETag', page['etag'])
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def page_server():
+    """ A local server for a single page, change server.page to change what it answers """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    server.page = {'body': '', 'etag': None, 'status': 200}
+    server.requests = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/page'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,11 @@
+"""
+Run the benchmark end to end on a tiny workload, so the profiler's hooks can't go stale
+"""
+from benchmark import parse_arguments, run_benchmark
+
+def test_benchmark_runs_a_tiny_workload():
+    args = parse_arguments(['--watchers', '3', '--ticks', '2', '--page-size', '2000', '--patterns', '4'])
+    results = run_benchmark(args)
+    assert [tick['pages'] for tick in results['ticks']] == [3, 3]
+    assert results['fetch_latency_p50'] is not None
+    assert results['cpu_time_match'] > 0
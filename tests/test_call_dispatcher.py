@@ -0,0 +1,118 @@
+"""
+Test the CallDispatcher's window, cooldown and SMS fallback
+"""
+import time
+import threading
+from call_dispatcher import CallDispatcher
+
+class Phone:
+    """ A call or sms callable that records the messages and fails the first few times """
+    def __init__(self, failures: int=0):
+        self.failures = failures
+        self.attempts = 0
+        self.received = []
+        self.received_event = threading.Event()
+
+
+    def __call__(self, messages: list):
+        self.attempts += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError('the line is busy')
+        self.received.append((time.monotonic(), list(messages)))
+        self.received_event.set()
+
+
+    def wait(self, timeout: float=5):
+        """ Wait for the next delivery """
+        received = self.received_event.wait(timeout)
+        self.received_event.clear()
+        return received
+
+
+def test_publish_never_blocks_and_the_window_merges_changes():
+    phone = Phone()
+    dispatcher = CallDispatcher(phone, window=0.2, cooldown=0, retries=0)
+    try:
+        start = time.monotonic()
+        dispatcher.publish('a', ['a1'])
+        dispatcher.publish('b', ['b1'])
+        dispatcher.publish('a', ['a1', 'a2'])
+        assert time.monotonic() - start < 0.05
+        assert phone.wait()
+        called_at, messages = phone.received[0]
+        # A repeated message is said once
+        assert messages == ['a1', 'a2', 'b1']
+        assert called_at - start >= 0.15
+    finally:
+        dispatcher.close()
+    assert len(phone.received) == 1
+
+
+def test_cooldown_holds_back_a_watcher_but_not_the_others():
+    phone = Phone()
+    dispatcher = CallDispatcher(phone, window=0.1, cooldown=0.6, retries=0)
+    try:
+        dispatcher.publish('a', ['a1'])
+        assert phone.wait()
+        first_call = phone.received[0][0]
+        dispatcher.publish('a', ['a2'])
+        dispatcher.publish('b', ['b1'])
+        assert phone.wait()
+        # b is called about after its window, a waits out its cooldown
+        assert phone.received[1][1] == ['b1']
+        assert phone.received[1][0] - first_call < 0.5
+        assert phone.wait()
+        assert phone.received[2][1] == ['a2']
+        assert phone.received[2][0] - first_call >= 0.55
+    finally:
+        dispatcher.close()
+
+
+def test_max_messages_keeps_the_newest():
+    phone = Phone()
+    dispatcher = CallDispatcher(phone, window=0.1, cooldown=0, retries=0, max_messages=2)
+    try:
+        dispatcher.publish('a', ['1', '2', '3'])
+        assert phone.wait()
+        assert phone.received[0][1] == ['2', '3']
+    finally:
+        dispatcher.close()
+
+
+def test_a_failing_call_is_retried():
+    phone = Phone(failures=1)
+    texts = Phone()
+    dispatcher = CallDispatcher(phone, texts, window=0.05, cooldown=0, retries=2, backoff=0.05)
+    try:
+        dispatcher.publish('a', ['a1'])
+        assert phone.wait()
+        assert phone.attempts == 2
+        assert phone.received[0][1] == ['a1']
+    finally:
+        dispatcher.close()
+    assert texts.received == []
+
+
+def test_messages_are_texted_when_every_call_fails():
+    phone = Phone(failures=10)
+    texts = Phone()
+    dispatcher = CallDispatcher(phone, texts, window=0.05, cooldown=0, retries=2, backoff=0.02)
+    try:
+        dispatcher.publish('a', ['a1'])
+        assert texts.wait()
+        assert phone.attempts == 3
+        assert phone.received == []
+        assert texts.received[0][1] == ['a1']
+    finally:
+        dispatcher.close()
+
+
+def test_close_drops_waiting_messages():
+    phone = Phone()
+    dispatcher = CallDispatcher(phone, window=10, cooldown=0)
+    dispatcher.publish('a', ['a1'])
+    start = time.monotonic()
+    dispatcher.close()
+    assert time.monotonic() - start < 1
+    assert phone.received == []
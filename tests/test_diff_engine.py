@@ -0,0 +1,29 @@
+"""
+Test the block-level diff reported with a change
+"""
+from watcher.diff_engine import diff_text, split_blocks
+
+def test_blocks_split_at_tags_and_line_breaks():
+    assert split_blocks('<p>Price: 10</p>\n<p> In stock </p>\n\n') == ['Price: 10', 'In stock']
+
+
+def test_identical_pages_have_no_diff():
+    assert diff_text('<p>a</p><p>b</p>', '<p>a</p><p>b</p>') == []
+
+
+def test_changed_blocks_are_reported_as_removed_and_added():
+    old = '<p>Price: 10</p><p>In stock</p>'
+    new = '<p>Price: 12</p><p>In stock</p><p>Free shipping</p>'
+    assert diff_text(old, new) == ['-Price: 10', '+Price: 12', '+Free shipping']
+
+
+def test_collapsed_pages_still_diff_by_block():
+    old = '<div><span>one</span><span>two</span></div>'
+    new = '<div><span>one</span><span>three</span></div>'
+    assert diff_text(old, new) == ['-two', '+three']
+
+
+def test_diff_is_cut_at_max_blocks():
+    old = ''.join(f'<p>old {index}</p>' for index in range(10))
+    new = ''.join(f'<p>new {index}</p>' for index in range(10))
+    assert len(diff_text(old, new, max_blocks=5)) == 5
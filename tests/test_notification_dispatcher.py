@@ -0,0 +1,126 @@
+"""
+Test the TokenBucket rate limits and the NotificationDispatcher's ordering and retries
+"""
+import time
+import threading
+import pytest
+from notification_dispatcher import NotificationDispatcher, TokenBucket, coalesce
+
+def test_full_bucket_allows_a_burst_of_its_capacity():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.consume()
+    assert bucket.delay(now) == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=4, capacity=1)
+    now = bucket.updated
+    bucket.consume()
+    assert bucket.delay(now) == pytest.approx(0.25)
+    assert bucket.delay(now + 0.125) == pytest.approx(0.125)
+    assert bucket.delay(now + 0.25) == 0
+
+
+def test_bucket_never_holds_more_than_its_capacity():
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = bucket.updated
+    bucket.delay(now + 100)
+    assert bucket.tokens == 2
+
+
+def test_bucket_ignores_time_going_backwards():
+    bucket = TokenBucket(rate=1, capacity=1)
+    now = bucket.updated
+    bucket.consume()
+    bucket.delay(now + 0.5)
+    bucket.delay(now)
+    assert bucket.tokens == pytest.approx(0.5)
+
+
+def test_coalesce_merges_lines_up_to_the_limit():
+    assert coalesce(['a', 'b', 'c'], 100) == ['a\n\nb\n\nc']
+    assert coalesce(['aaaa', 'bbbb'], 8) == ['aaaa', 'bbbb']
+    assert coalesce(['aaaa', 'bbbb'], 10) == ['aaaa\n\nbbbb']
+
+
+def test_coalesce_cuts_lines_that_are_too_long():
+    messages = coalesce(['x', 'y' * 25, 'z'], 10)
+    assert messages == ['x', 'y' * 10, 'y' * 10, 'y' * 5 + '\n\nz']
+    assert all(len(message) <= 10 for message in messages)
+
+
+class Recorder:
+    """ A send callable that fails the first attempts of some messages """
+    def __init__(self, failures: dict=None, exception=ConnectionError):
+        self.failures = dict(failures or {})
+        self.exception = exception
+        self.sent = []
+        self.attempts = []
+        self.done = threading.Event()
+        self.expected = None
+
+
+    def __call__(self, chat_id: int, text: str):
+        self.attempts.append((chat_id, text))
+        if self.failures.get(text, 0) > 0:
+            self.failures[text] -= 1
+            raise self.exception(f'could not send {text}')
+        self.sent.append((chat_id, text))
+        if self.expected is not None and len(self.sent) >= self.expected:
+            self.done.set()
+
+
+def run_dispatcher(recorder: Recorder, expected: int, publish, **options):
+    recorder.expected = expected
+    dispatcher = NotificationDispatcher(
+        recorder, per_chat_rate=1000, global_rate=1000, max_length=1, backoff=0.01, **options
+    )
+    try:
+        publish(dispatcher)
+        recorder.done.wait(5)
+        # Leave time for anything that should not be sent to show up
+        time.sleep(0.1)
+    finally:
+        dispatcher.close()
+
+
+def test_every_chat_gets_its_messages_in_order_despite_retries():
+    recorder = Recorder(failures={'b': 2})
+    run_dispatcher(recorder, 6, lambda dispatcher: dispatcher.publish(['a', 'b', 'c'], [1, 2]))
+    for chat_id in (1, 2):
+        assert [text for chat, text in recorder.sent if chat == chat_id] == ['a', 'b', 'c']
+
+
+def test_failed_messages_are_given_up_after_the_retries():
+    recorder = Recorder(failures={'b': 10})
+    run_dispatcher(recorder, 2, lambda dispatcher: dispatcher.publish(['a', 'b', 'c'], [1]), retries=2)
+    assert recorder.sent == [(1, 'a'), (1, 'c')]
+    assert recorder.attempts.count((1, 'b')) == 3
+
+
+def test_errors_that_are_not_retryable_are_dropped_right_away():
+    recorder = Recorder(failures={'a': 1}, exception=PermissionError)
+    retryable = lambda exception: not isinstance(exception, PermissionError)
+    run_dispatcher(recorder, 1, lambda dispatcher: dispatcher.publish(['a', 'b'], [1]), retryable=retryable)
+    assert recorder.sent == [(1, 'b')]
+    assert recorder.attempts.count((1, 'a')) == 1
+
+
+def test_per_chat_rate_spaces_out_a_chats_messages():
+    sent = []
+    done = threading.Event()
+    def send(chat_id: int, text: str):
+        sent.append(time.monotonic())
+        if len(sent) == 3:
+            done.set()
+    dispatcher = NotificationDispatcher(send, per_chat_rate=10, global_rate=1000, max_length=1)
+    try:
+        dispatcher.publish(['a', 'b', 'c'], [1])
+        assert done.wait(5)
+    finally:
+        dispatcher.close()
+    # The chat's bucket holds a single token, so the second and third message wait 0.1 seconds each
+    assert sent[2] - sent[0] >= 0.18
@@ -0,0 +1,75 @@
+"""
+Test the PatternMatcher's single-scan matching and its match bitsets
+"""
+import random
+from watcher.body_scanner import BodyScanner
+from watcher.pattern_matcher import PatternMatcher, shared_matcher
+
+def test_literal_search_agrees_with_the_in_operator():
+    generator = random.Random(3)
+    alphabet = 'abc.*('
+    for _ in range(2000):
+        whitelist = [''.join(generator.choices(alphabet, k=generator.randint(1, 4))) for _ in range(generator.randint(0, 6))]
+        blacklist = [''.join(generator.choices(alphabet, k=generator.randint(1, 4))) for _ in range(generator.randint(0, 6))]
+        text = ''.join(generator.choices(alphabet, k=generator.randint(0, 40)))
+        expected = ([word for word in whitelist if word in text], [word for word in blacklist if word in text])
+        assert PatternMatcher(whitelist, blacklist).search(text) == expected
+
+
+def test_regex_patterns_shadowed_at_the_same_position_are_found():
+    matcher = PatternMatcher(['Sale'], ['Sale now'], True)
+    assert matcher.search('Big Sale now on') == (['Sale'], ['Sale now'])
+    assert matcher.search('Big Sale later') == (['Sale'], [])
+
+
+def test_first_hits_keeps_only_the_first_position():
+    matcher = PatternMatcher(['ab', 'b'], [])
+    assert matcher.first_hits('xxab ab b') == {'ab': 2, 'b': 3}
+
+
+def test_bitsets_roundtrip_through_the_saved_lists():
+    matcher = PatternMatcher(['new', 'sale'], ['sold out', 'sale'])
+    bits = matcher.match_bits(matcher.first_hits('a new sale'))
+    # 'sale' is on both lists, so it sets a whitelist and a blacklist bit
+    assert bits == 0b1011
+    assert matcher.split_bits(bits) == (['new', 'sale'], ['sale'])
+    assert matcher.bits_of(['new', 'sale'], ['sale']) == bits
+
+
+def test_bits_of_drops_patterns_no_longer_in_the_lists():
+    matcher = PatternMatcher(['new'], ['sold out'])
+    assert matcher.bits_of(['new', 'removed'], ['sold out', 'gone']) == 0b11
+    assert matcher.bits_of([], []) == 0
+
+
+def test_empty_lists_never_match():
+    matcher = PatternMatcher([], [])
+    assert matcher.first_hits('anything') == {}
+    assert matcher.search('anything') == ([], [])
+
+
+def test_shared_matcher_is_reused_for_the_same_lists():
+    first = shared_matcher(['a'], ['b'])
+    assert shared_matcher(['a'], ['b']) is first
+    assert shared_matcher(['a'], ['b'], True) is not first
+
+
+def scan_in_chunks(matcher: PatternMatcher, body: bytes, chunk_size: int):
+    scanner = BodyScanner(matcher)
+    for start in range(0, len(body), chunk_size):
+        scanner.feed(body[start:start + chunk_size])
+    return scanner.finish().hits
+
+
+def test_hits_spanning_chunks_are_found_once_at_their_first_position():
+    matcher = PatternMatcher(['sold out', 'price'], ['error'])
+    body = b'....sold out....price....sold out....'
+    expected = matcher.first_hits(body.decode('ascii'))
+    for chunk_size in (1, 3, 5, 7, 64):
+        assert scan_in_chunks(matcher, body, chunk_size) == expected
+    assert expected == {'sold out': 4, 'price': 16}
+
+
+def test_regex_hits_spanning_chunks_are_found():
+    matcher = PatternMatcher([r'price: \d+'], [], True)
+    assert scan_in_chunks(matcher, b'the price: 12 today', 4) == {r'price: \d+': 4}
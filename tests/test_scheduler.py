@@ -0,0 +1,108 @@
+"""
+Test the WatchScheduler's adaptive intervals and jitter
+"""
+from types import SimpleNamespace
+from watcher.scheduler import WatchScheduler
+
+def make_watcher(name: str='page', interval: float=None):
+    return SimpleNamespace(name=name, interval=interval)
+
+
+def test_new_watchers_are_due_right_away():
+    scheduler = WatchScheduler(default_interval=60, jitter=0)
+    watcher = make_watcher()
+    scheduler.add(watcher, now=100)
+    assert scheduler.pop_due(now=100) == [watcher]
+    assert scheduler.pop_due(now=100) == []
+
+
+def test_unchanged_pages_back_off_up_to_max_factor():
+    scheduler = WatchScheduler(default_interval=10, backoff_factor=2, max_factor=4, jitter=0)
+    watcher = make_watcher()
+    scheduler.add(watcher, now=0)
+    scheduler.pop_due(now=0)
+    intervals = []
+    for _ in range(4):
+        scheduler.reschedule(watcher, False, now=0)
+        intervals.append(scheduler.entries['page'].interval)
+    assert intervals == [20, 40, 40, 40]
+
+
+def test_changing_pages_speed_up_down_to_min_factor():
+    scheduler = WatchScheduler(default_interval=10, change_factor=0.5, min_factor=0.25, jitter=0)
+    watcher = make_watcher()
+    scheduler.add(watcher, now=0)
+    scheduler.pop_due(now=0)
+    intervals = []
+    for _ in range(3):
+        scheduler.reschedule(watcher, True, now=0)
+        intervals.append(scheduler.entries['page'].interval)
+    assert intervals == [5, 2.5, 2.5]
+
+
+def test_failed_checks_keep_the_interval():
+    scheduler = WatchScheduler(default_interval=10, jitter=0)
+    watcher = make_watcher()
+    scheduler.add(watcher, now=0)
+    scheduler.pop_due(now=0)
+    scheduler.reschedule(watcher, None, now=0)
+    assert scheduler.entries['page'].interval == 10
+    assert scheduler.seconds_until_due(now=0) == 10
+
+
+def test_without_adaptive_the_interval_never_changes():
+    scheduler = WatchScheduler(default_interval=10, adaptive=False, jitter=0)
+    watcher = make_watcher()
+    scheduler.add(watcher, now=0)
+    scheduler.pop_due(now=0)
+    scheduler.reschedule(watcher, True, now=0)
+    assert scheduler.entries['page'].interval == 10
+
+
+def test_missed_slots_are_skipped_instead_of_bursting():
+    scheduler = WatchScheduler(default_interval=10, adaptive=False, jitter=0)
+    watcher = make_watcher()
+    scheduler.add(watcher, now=0)
+    scheduler.pop_due(now=0)
+    # The check took much longer than the interval
+    scheduler.reschedule(watcher, False, now=35)
+    assert scheduler.pop_due(now=35) == [watcher]
+
+
+def test_jitter_stays_within_its_share_of_the_interval():
+    scheduler = WatchScheduler(default_interval=10, adaptive=False, jitter=0.2)
+    watchers = [make_watcher(f'page{index}', 100) for index in range(200)]
+    for watcher in watchers:
+        scheduler.add(watcher, now=0)
+    fire_times = [entry.fire_time for entry in scheduler.entries.values()]
+    assert all(0 <= fire_time <= 20 for fire_time in fire_times)
+    # Spread out, rather than all at once
+    assert len(set(fire_times)) > 100
+    assert scheduler.pop_due(now=20) != []
+    assert len(scheduler.pop_due(now=20)) == 0
+
+
+def test_removed_watchers_are_never_due():
+    scheduler = WatchScheduler(default_interval=10, jitter=0)
+    watcher = make_watcher()
+    scheduler.add(watcher, now=0)
+    scheduler.remove(watcher)
+    assert scheduler.pop_due(now=100) == []
+
+
+def test_watchers_with_a_taken_name_are_skipped(caplog):
+    from watcher.watcher_manager import WatcherManager
+    watcher_items = [
+        {'Name': 'page', 'URL': f'http://127.0.0.1/{index}', 'Whitelist': [], 'Blacklist': [], 'AlertAnyChange': True}
+        for index in range(2)
+    ]
+    manager = WatcherManager(watcher_items, schedule_config={'jitter': 0})
+    try:
+        assert [watcher.url for watcher in manager.watchers] == ['http://127.0.0.1/0']
+        assert manager.watcher_items['page']['URL'] == 'http://127.0.0.1/0'
+        assert manager.scheduler.pop_due() == manager.watchers
+        assert 'Duplicate watcher name (page)' in caplog.text
+        # A reload keeps the same one, so nothing looks changed
+        assert manager.apply_watchers(watcher_items) == ([], [], [])
+    finally:
+        manager.close()
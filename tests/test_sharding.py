@@ -0,0 +1,139 @@
+"""
+Test that the HashRing only moves the watchers a worker gains or loses, and applying watchers to the shards
+"""
+import json
+import time
+from config_reloader import ConfigReloader
+from watcher.sharding import HashRing, ShardedWatcherManager, watcher_key
+
+def make_items(count: int=1000):
+    return [
+        {
+            'Name': f'page{index}', 'URL': f'https://example{index % 7}.com/{index}',
+            'Whitelist': [], 'Blacklist': [], 'AlertAnyChange': True
+        }
+        for index in range(count)
+    ]
+
+
+def owners(ring: HashRing, items: list):
+    return {watcher_key(item): ring.get(watcher_key(item)) for item in items}
+
+
+def test_empty_ring_has_no_owner():
+    assert HashRing().get('anything') is None
+    assert HashRing().assign(make_items(10)) == dict()
+
+
+def test_assign_covers_every_watcher_once():
+    items = make_items()
+    shards = HashRing(['a', 'b', 'c']).assign(items)
+    assert set(shards) == {'a', 'b', 'c'}
+    assigned = [watcher_key(item) for shard in shards.values() for item in shard]
+    assert sorted(assigned) == sorted(watcher_key(item) for item in items)
+
+
+def test_load_is_spread_between_workers():
+    shards = HashRing(['a', 'b', 'c', 'd']).assign(make_items(4000))
+    # 1000 each if perfectly even, 100 replicas keep every worker well within 2x of that
+    assert all(500 < len(shard) < 2000 for shard in shards.values())
+
+
+def test_adding_a_worker_only_moves_watchers_to_it():
+    items = make_items()
+    ring = HashRing(['a', 'b', 'c'])
+    before = owners(ring, items)
+    ring.add('d')
+    after = owners(ring, items)
+    moved = [key for key in before if before[key] != after[key]]
+    assert len(moved) > 0
+    assert all(after[key] == 'd' for key in moved)
+    # About a quarter of the watchers move to the new worker, not a reshuffle of all of them
+    assert len(moved) < len(items) / 2
+
+
+def test_removing_a_worker_only_moves_its_watchers():
+    items = make_items()
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    before = owners(ring, items)
+    ring.remove('b')
+    after = owners(ring, items)
+    for key in before:
+        if before[key] == 'b':
+            assert after[key] in ('a', 'c', 'd')
+        else:
+            assert after[key] == before[key]
+
+
+def test_placement_does_not_depend_on_the_order_workers_joined():
+    items = make_items(200)
+    assert owners(HashRing(['a', 'b', 'c']), items) == owners(HashRing(['c', 'a', 'b']), items)
+
+
+def test_removing_the_added_worker_restores_the_placement():
+    items = make_items(200)
+    ring = HashRing(['a', 'b'])
+    before = owners(ring, items)
+    ring.add('c')
+    ring.remove('c')
+    assert owners(ring, items) == before
+
+
+def write_config(path, watchers: list):
+    raw_config = {'mode': {'telegram': False, 'twilio': True}, 'twilio_config': {}, 'watchers': watchers}
+    path.write_text(json.dumps(raw_config))
+
+
+def test_listening_notifier_applies_watchers_without_local_workers(tmp_path):
+    config_path = tmp_path / 'config.json'
+    write_config(config_path, [])
+    manager = ShardedWatcherManager([], sharding_config={'listen': '127.0.0.1:0'})
+    reloader = ConfigReloader(str(config_path), manager)
+    try:
+        item = {'Name': 'page', 'URL': 'http://127.0.0.1/page', 'Whitelist': [], 'Blacklist': [], 'AlertAnyChange': True}
+        reloader.add_watcher(item)
+        assert list(manager.by_name) == ['page']
+        assert reloader.remove_watcher('page')
+        assert manager.by_name == dict()
+    finally:
+        reloader.close()
+        manager.close()
+
+
+def test_no_local_workers_applies_watchers():
+    manager = ShardedWatcherManager([], sharding_config={'workers': 0})
+    try:
+        manager.apply_watchers(make_items(5))
+        assert len(manager.by_name) == 5
+    finally:
+        manager.close()
+
+
+class FlakyManager:
+    """ A manager whose first apply_watchers() fails """
+    def __init__(self):
+        self.applied = []
+
+
+    def apply_watchers(self, watchers: list):
+        self.applied.append(watchers)
+        if len(self.applied) == 1:
+            raise RuntimeError('could not apply')
+
+
+def test_a_failed_reload_does_not_stop_polling(tmp_path):
+    config_path = tmp_path / 'config.json'
+    write_config(config_path, [])
+    manager = FlakyManager()
+    reloader = ConfigReloader(str(config_path), manager, poll_interval=0.02)
+    try:
+        write_config(config_path, make_items(1))
+        deadline = time.monotonic() + 5
+        while len(manager.applied) < 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        write_config(config_path, make_items(2))
+        while len(manager.applied) < 2 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        reloader.close()
+    assert manager.applied[-1] == make_items(2)
@@ -0,0 +1,114 @@
+"""
+Test the line deltas and the SnapshotStore built on them
+"""
+import os
+import random
+import hashlib
+from watcher.snapshot_store import SnapshotStore, apply_delta, make_delta, split_lines
+
+def digest_of(text: str):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def roundtrip(base: str, text: str):
+    base_lines = split_lines(base)
+    return apply_delta(base_lines, make_delta(base_lines, split_lines(text)))
+
+
+def test_delta_roundtrip_of_edge_cases():
+    cases = [
+        ('', ''),
+        ('', 'new\n'),
+        ('old\n', ''),
+        ('a\nb\nc\n', 'a\nb\nc\n'),
+        ('a\nb\nc\n', 'a\nB\nc\n'),
+        ('a\nb\nc', 'a\nb\nc\nd'),
+        ('a\nb\nc\n', 'c\nb\na\n'),
+        ('a\na\na\n', 'a\na\na\na\n'),
+        ('a\r\nb\r\n', 'a\nb\r\n'),
+        ('x\ny\n', 'x\ny'),
+    ]
+    for base, text in cases:
+        assert roundtrip(base, text) == text
+
+
+def test_delta_roundtrip_of_random_edits():
+    generator = random.Random(1234)
+    vocabulary = [f'line {index}\n' for index in range(30)] + ['\n', 'no newline']
+    for _ in range(500):
+        base = [generator.choice(vocabulary) for _ in range(generator.randint(0, 40))]
+        lines = list(base)
+        for _ in range(generator.randint(0, 6)):
+            edit = generator.choice(('insert', 'delete', 'replace'))
+            position = generator.randint(0, len(lines))
+            if edit == 'insert':
+                lines.insert(position, generator.choice(vocabulary + ['brand new\n']))
+            elif lines and position < len(lines):
+                if edit == 'delete':
+                    del lines[position]
+                else:
+                    lines[position] = 'replaced\n'
+        base_text, text = ''.join(base), ''.join(lines)
+        assert roundtrip(base_text, text) == text
+
+
+def test_unchanged_runs_are_copied_not_repeated():
+    base = split_lines(''.join(f'line {index}\n' for index in range(100)))
+    lines = base[:50] + ['changed\n'] + base[51:]
+    assert make_delta(base, lines) == [[0, 50], 'changed\n', [51, 100]]
+
+
+def make_store(tmp_path, retention: int=20, keyframe_interval: int=10):
+    return SnapshotStore(str(tmp_path), retention=retention, keyframe_interval=keyframe_interval)
+
+
+def page_versions(count: int):
+    lines = [f'item {index}\n' for index in range(200)]
+    versions = []
+    for version in range(count):
+        lines[version % len(lines)] = f'item {version % len(lines)} changed in version {version}\n'
+        versions.append(''.join(lines))
+    return versions
+
+
+def test_store_loads_every_kept_version(tmp_path):
+    store = make_store(tmp_path, keyframe_interval=4)
+    versions = page_versions(12)
+    for text in versions:
+        store.save('page', digest_of(text), text)
+    assert [digest for digest, _ in store.history('page')] == [digest_of(text) for text in versions]
+    for text in versions:
+        assert store.load('page', digest_of(text)) == text
+
+
+def test_store_keeps_only_the_retained_versions(tmp_path):
+    store = make_store(tmp_path, retention=3, keyframe_interval=4)
+    versions = page_versions(10)
+    for text in versions:
+        store.save('page', digest_of(text), text)
+    assert [digest for digest, _ in store.history('page')] == [digest_of(text) for text in versions[-3:]]
+    for text in versions[-3:]:
+        assert store.load('page', digest_of(text)) == text
+    # Old versions are gone unless a kept delta is built on them
+    assert store.load('page', digest_of(versions[0])) is None
+    objects = [name for name in os.listdir(store.watcher_path('page')) if name != 'index.json']
+    assert len(objects) < len(versions)
+
+
+def test_store_keeps_delta_chains_short(tmp_path):
+    store = make_store(tmp_path, keyframe_interval=3)
+    for text in page_versions(7):
+        store.save('page', digest_of(text), text)
+    depths = [store.read_object('page', digest, with_payload=False)[2] for digest, _ in store.history('page')]
+    assert depths == [0, 1, 2, 0, 1, 2, 0]
+
+
+def test_store_separates_watchers_and_skips_zero_retention(tmp_path):
+    store = make_store(tmp_path)
+    store.save('first', digest_of('one'), 'one')
+    store.save('second', digest_of('two'), 'two')
+    store.save('third', digest_of('three'), 'three', retention=0)
+    assert store.load('first', digest_of('one')) == 'one'
+    assert store.load('first', digest_of('two')) is None
+    assert store.load('second', digest_of('two')) == 'two'
+    assert store.history('third') == []
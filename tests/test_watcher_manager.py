@@ -0,0 +1,76 @@
+"""
+Test that WatcherManager only trusts a page's validators once its change was recorded
+"""
+import pytest
+from watcher.watcher_manager import WatcherManager
+
+def make_manager(url: str, state_config: dict=None):
+    watcher_item = {'Name': 'page', 'URL': url, 'Whitelist': ['foo'], 'Blacklist': ['bar'], 'AlertAnyChange': True}
+    return WatcherManager([watcher_item], {'retries': 0}, state_config, {'jitter': 0})
+
+
+def test_a_failed_check_does_not_lose_the_change(page_server, tmp_path):
+    page_server.page.update(body='v1 foo', etag='"1"')
+    manager = make_manager(page_server.url, {'snapshots': {'path': str(tmp_path)}})
+    watcher = manager.watchers[0]
+    try:
+        assert not manager.run_watcher(watcher).did_change
+        page_server.page.update(body='v2 bar', etag='"2"')
+        save = manager.snapshots.save
+        def failing_save(*args, **kwargs):
+            raise OSError('disk full')
+        manager.snapshots.save = failing_save
+        with pytest.raises(OSError):
+            manager.run_watcher(watcher)
+        assert watcher.etag == '"1"'
+        manager.snapshots.save = save
+        change = manager.run_watcher(watcher)
+        assert change.did_change
+        assert change.new_blacklisted == ['bar'] and change.removed_whitelisted == ['foo']
+        assert watcher.etag == '"2"'
+    finally:
+        manager.close()
+
+
+def test_an_unchanged_page_is_requested_conditionally(page_server):
+    page_server.page.update(body='v1 foo', etag='"1"')
+    manager = make_manager(page_server.url)
+    watcher = manager.watchers[0]
+    try:
+        assert not manager.run_watcher(watcher).did_change
+        assert not manager.run_watcher(watcher).did_change
+    finally:
+        manager.close()
+    assert page_server.requests == [None, '"1"']
+
+
+def test_snapshots_are_taken_without_fetching_the_page_again(page_server, tmp_path):
+    page_server.page.update(body='v1 foo\n', etag='"1"')
+    manager = make_manager(page_server.url, {'snapshots': {'path': str(tmp_path)}})
+    watcher = manager.watchers[0]
+    try:
+        manager.run_watcher(watcher)
+        page_server.page.update(body='v1 foo\nv2 bar\n', etag='"2"')
+        assert manager.run_watcher(watcher).did_change
+        versions = [digest for digest, _ in manager.snapshots.history('page')]
+        assert [manager.snapshots.load('page', digest) for digest in versions] == ['v1 foo\n', 'v1 foo\nv2 bar\n']
+    finally:
+        manager.close()
+    # One request per check, the second of them conditional
+    assert page_server.requests == [None, '"1"']
+
+
+def test_a_failed_check_with_snapshots_reports_the_change_later(page_server, tmp_path):
+    page_server.page.update(body='v1 foo', etag='"1"')
+    manager = make_manager(page_server.url, {'snapshots': {'path': str(tmp_path)}})
+    watcher = manager.watchers[0]
+    try:
+        manager.run_watcher(watcher)
+        page_server.page.update(status=502)
+        with pytest.raises(Exception):
+            manager.run_watcher(watcher)
+        page_server.page.update(body='v2 bar', etag='"2"', status=200)
+        assert manager.run_watcher(watcher).did_change
+        assert not manager.run_watcher(watcher).did_change
+    finally:
+        manager.close()